@@ -42,6 +42,12 @@ CSV_MANUAL_DIR = os.path.join(CSV_OUTPUT_DIR, "manual")
 CSV_FAQ_DIR = os.path.join(CSV_OUTPUT_DIR, "faq")
 TOC_XLSX_DIR = os.path.join(XLSX_INPUT_DIR, "toc")
 
+# Page-range PDFs cut from the sources: an in-memory LRU (bytes) in front of a content-addressed directory
+# keyed by source checksum and page range (PDF_PAGE_CACHE_DIR empty: memory only), extracted by PDF_RENDER_WORKERS threads
+PDF_PAGE_CACHE_DIR = os.getenv("PDF_PAGE_CACHE_DIR", "/pdf_cache")
+PDF_PAGE_CACHE_MEMORY_BYTES = int(os.getenv("PDF_PAGE_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", 4))
+
 # POSTGRES
 POSTGRES_DB = os.getenv("POSTGRES_DB", "aurora")
 POSTGRES_USER = os.getenv("POSTGRES_USER", "user")
@@ -49,23 +55,61 @@ POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "pass")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "aurora")
 POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", 5432))
 
+# Connection pool settings
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+
+# Admission control for database work (queries waiting for a pool connection / seconds to wait before "busy")
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 20))
+ADMISSION_TIMEOUT = float(os.getenv("ADMISSION_TIMEOUT", 5))
+
 # pgvector settings
 OPERATOR = os.getenv("OPERATOR", "<#>")
 
+# Embedding column storage type ("vector": float32 with a halfvec expression index, "halfvec": native float16)
+EMBEDDING_STORAGE_TYPE = os.getenv("EMBEDDING_STORAGE_TYPE", "vector").lower()
+
 # Index settings
 INDEX_TYPE = os.getenv("INDEX_TYPE", "hnsw").lower()
 HNSW_SETTINGS = json.loads(os.getenv("HNSW_SETTINGS", '{"m": 16, "ef_construction": 256, "ef_search": 500}'))
 HNSW_M = HNSW_SETTINGS.get("m", 16)
 HNSW_EF_CONSTRUCTION = HNSW_SETTINGS.get("ef_construction", 256)
 HNSW_EF_SEARCH = HNSW_SETTINGS.get("ef_search", 500)
+HNSW_CANDIDATE_MULTIPLIER = HNSW_SETTINGS.get("candidate_multiplier", 10)
+
+# Search strategy ("hnsw": halfvec HNSW, "binary_rerank": binary-quantized HNSW prefilter + exact rerank,
+# "short_rerank": HNSW over the truncated embedding_short column + exact rerank)
+SEARCH_STRATEGY = os.getenv("SEARCH_STRATEGY", "hnsw").lower()
+
+# Dimensions of the Matryoshka-truncated embedding_short column (0: column not stored)
+SHORT_EMBEDDING_DIMENSIONS = int(os.getenv("SHORT_EMBEDDING_DIMENSIONS", 0))
+# Iterative HNSW scans need pgvector 0.8.0+ (aurora/Dockerfile); older versions use an exact category scan when under-filled
+HNSW_ITERATIVE_SCAN = HNSW_SETTINGS.get("iterative_scan", "relaxed_order")
+HNSW_MAX_SCAN_TUPLES = HNSW_SETTINGS.get("max_scan_tuples", 20000)
+
+# Categories with at most this many chunks in a table are searched with an exact scan instead of HNSW
+EXACT_SEARCH_MAX_ROWS = int(os.getenv("EXACT_SEARCH_MAX_ROWS", 2000))
+
+# Fraction of searches re-run unprepared with EXPLAIN ANALYZE; /metrics reports them as search_adhoc_plan.*
+SEARCH_EXPLAIN_SAMPLE_RATE = float(os.getenv("SEARCH_EXPLAIN_SAMPLE_RATE", 0))
 
 # PostgreSQL table settings
 DOCUMENT_TABLE = os.getenv("DOCUMENT_TABLE", "document_table")
 DOCUMENT_CATEGORY_TABLE = os.getenv("DOCUMENT_CATEGORY_TABLE","document_category_table")
 XLSX_TOC_TABLE = os.getenv("XLSX_TOC_TABLE", "xlsx_toc_table")
+XLSX_TOC_ENTRY_TABLE = os.getenv("XLSX_TOC_ENTRY_TABLE", "xlsx_toc_entry_table")
 PDF_MANUAL_TABLE = os.getenv("PDF_MANUAL_TABLE", "pdf_manual_table")
 PDF_FAQ_TABLE = os.getenv("PDF_FAQ_TABLE", "pdf_faq_table")
 
+# Seconds between document_table change checks for the in-process metadata cache
+DOCUMENT_CACHE_CHECK_INTERVAL = float(os.getenv("DOCUMENT_CACHE_CHECK_INTERVAL", 30))
+
+# /categories cache: fresh for CATEGORY_CACHE_TTL seconds, then served stale for up to
+# CATEGORY_CACHE_STALE more seconds while it is refreshed in the background
+CATEGORY_CACHE_TTL = float(os.getenv("CATEGORY_CACHE_TTL", 300))
+CATEGORY_CACHE_STALE = float(os.getenv("CATEGORY_CACHE_STALE", 3600))
+
 # Document types
 DOCUMENT_TYPE_PDF_MANUAL = 1
 DOCUMENT_TYPE_PDF_FAQ = 2
@@ -89,6 +133,69 @@ DEFAULT_BUSINESS_CATEGORY_MAPPING = {
 # Load business category mapping from environment variable if available
 BUSINESS_CATEGORY_MAPPING = json.loads(os.getenv('BUSINESS_CATEGORY_MAPPING', json.dumps(DEFAULT_BUSINESS_CATEGORY_MAPPING)))
 
+# Search backend ("postgres": pgvector, "numpy": in-process matrix search,
+# "auto": numpy for categories with at most NUMPY_SEARCH_MAX_ROWS chunks, pgvector otherwise)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "postgres").lower()
+NUMPY_SEARCH_MAX_ROWS = int(os.getenv("NUMPY_SEARCH_MAX_ROWS", 50000))
+NUMPY_SEARCH_DTYPE = os.getenv("NUMPY_SEARCH_DTYPE", "float16")
+
+# Embedding snapshot written by the batch job; the numpy search backend memory-maps it
+# when its document version matches document_table (CURRENT is checked every DOCUMENT_CACHE_CHECK_INTERVAL)
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "/snapshot")
+
+# TOC routing ("vector": top TOC entries by similarity to the question embedding,
+# "llm": GPT-4o reads the category's whole TOC; vector falls back to llm when a category has no TOC entries)
+TOC_ROUTING_MODE = os.getenv("TOC_ROUTING_MODE", "vector").lower()
+TOC_ROUTING_TOP_N = int(os.getenv("TOC_ROUTING_TOP_N", 2))
+
+# Number of search results used per question
+MANUAL_RESULT_LIMIT = int(os.getenv("MANUAL_RESULT_LIMIT", 4))
+FAQ_RESULT_LIMIT = int(os.getenv("FAQ_RESULT_LIMIT", 3))
+
+# LLM streaming: deltas are batched into one websocket frame per STREAM_FLUSH_INTERVAL_MS
+# or STREAM_FLUSH_BYTES of text, whichever comes first (STREAM_FLUSH_INTERVAL_MS=0 sends every delta)
+STREAM_FLUSH_INTERVAL_MS = float(os.getenv("STREAM_FLUSH_INTERVAL_MS", 30))
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", 256))
+
+# FAQ fast path: when the best FAQ hit's cosine distance to the question (1 - cosine similarity, computed from
+# the embeddings whatever OPERATOR is) is below FAQ_FAST_PATH_DISTANCE (0 disables it),
+# that FAQ answers the question without TOC routing or the full-context prompt
+# ("verbatim": the FAQ text is sent as is, "rephrase": FAQ_FAST_PATH_DEPLOY_NAME writes a short answer from it)
+FAQ_FAST_PATH_DISTANCE = float(os.getenv("FAQ_FAST_PATH_DISTANCE", 0))
+FAQ_FAST_PATH_MODE = os.getenv("FAQ_FAST_PATH_MODE", "verbatim").lower()
+FAQ_FAST_PATH_DEPLOY_NAME = os.getenv("FAQ_FAST_PATH_DEPLOY_NAME", MODEL_GPT4o_DEPLOY_NAME)
+
+# Question embedding cache (LRU entries, TTL in seconds; EMBEDDING_CACHE_PATH enables an sqlite store
+# that survives restarts, e.g. /app/data/cache/embeddings.sqlite3; EMBEDDING_CACHE_SIZE=0 disables the cache)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 1024))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", 86400))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+
+# Semantic answer cache: a question in the same category whose embedding has a cosine similarity of
+# ANSWER_CACHE_SIMILARITY or more to a recently answered one gets that answer replayed (LRU entries, TTL in
+# seconds; entries are dropped when document checksums change; ANSWER_CACHE_SIZE=0 disables the cache)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 500))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.97))
+
+# Diversity selection of search hits (MMR): MANUAL/FAQ_RESULT_LIMIT x MMR_CANDIDATE_MULTIPLIER candidates
+# are fetched; MMR_LAMBDA weighs relevance against similarity to context already chosen, and candidates with a
+# cosine similarity of DEDUP_SIMILARITY_THRESHOLD or more to chosen context (page ranges included) are dropped
+MMR_CANDIDATE_MULTIPLIER = int(os.getenv("MMR_CANDIDATE_MULTIPLIER", 3))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))
+DEDUP_SIMILARITY_THRESHOLD = float(os.getenv("DEDUP_SIMILARITY_THRESHOLD", 0.95))
+
+# Prompt context token budgets per source ("page": TOC-routed page ranges, "manual"/"faq": search hits,
+# "toc": TOC text in the LLM routing prompt), counted locally with the CONTEXT_TOKEN_ENCODING tiktoken encoding
+CONTEXT_TOKEN_ENCODING = os.getenv("CONTEXT_TOKEN_ENCODING", "o200k_base")
+CONTEXT_TOKEN_SETTINGS = json.loads(os.getenv("CONTEXT_TOKEN_BUDGETS", '{"page": 3000, "manual": 2000, "faq": 1000, "toc": 4000}'))
+CONTEXT_TOKEN_BUDGETS = {
+    "page": CONTEXT_TOKEN_SETTINGS.get("page", 3000),
+    "manual": CONTEXT_TOKEN_SETTINGS.get("manual", 2000),
+    "faq": CONTEXT_TOKEN_SETTINGS.get("faq", 1000),
+    "toc": CONTEXT_TOKEN_SETTINGS.get("toc", 4000)
+}
+
 # Other settings
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", "1000"))
 PIPELINE_EXECUTION_MODE = os.getenv("PIPELINE_EXECUTION_MODE", "csv_to_aurora")
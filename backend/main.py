@@ -1,17 +1,36 @@
 # backend/main.py
-from fastapi import FastAPI, WebSocket, HTTPException
+from fastapi import FastAPI, WebSocket, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.websockets import WebSocketDisconnect, WebSocketState
+from contextlib import asynccontextmanager
+import asyncio
 import logging
-from utils.pdf_utils import get_pdf
-from utils.db_utils import get_db_connection, get_available_categories
+from utils.pdf_utils import get_pdf, close_pdf_executor
+from utils.db_utils import get_available_categories, open_db_pool, close_db_pool, get_pool_metrics
+from utils.metrics_utils import get_metrics_snapshot
+from utils.context_utils import get_token_encoding
+from utils.embedding_cache_utils import close_embedding_cache
 from utils.websocket_utils import get_openai_client, process_websocket_message_openai
+from utils.session_utils import WebSocketSession
 from config import *
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_db_pool()
+    # Load the tokenizer before the first question instead of during it
+    await asyncio.to_thread(get_token_encoding)
+    try:
+        yield
+    finally:
+        await client.close()
+        await close_db_pool()
+        close_embedding_cache()
+        close_pdf_executor()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,34 +45,47 @@ client = get_openai_client()
 @app.get("/categories")
 async def get_categories():
     try:
-        categories = get_available_categories()
+        categories = await get_available_categories()
         return {"categories": categories}
     except Exception as e:
         logger.error(f"Error fetching categories: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/metrics")
+async def get_metrics():
+    metrics = get_metrics_snapshot()
+    metrics["db_pool"] = get_pool_metrics()
+    return metrics
+
 @app.get("/pdf/{document_type}/{category}/{path:path}")
-async def serve_pdf(document_type: str, category: str, path: str, page: int = None, start_page: int = None, end_page: int = None):
-    return get_pdf(document_type, category, path, page, start_page, end_page)
+async def serve_pdf(request: Request, document_type: str, category: str, path: str, page: int = None, start_page: int = None, end_page: int = None):
+    return await get_pdf(request, document_type, category, path, page, start_page, end_page)
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     logger.info("WebSocket connection established")
 
-    db_pool = get_db_connection()
-
+    # Questions run concurrently as tasks; {"cancel": true, "request_id": ...} stops one of them
+    session = WebSocketSession(websocket)
     try:
-        with db_pool.connection() as conn:
-            while websocket.client_state == WebSocketState.CONNECTED:
-                data = await websocket.receive_json()
-                await process_websocket_message_openai(websocket, conn, data, client)
+        while websocket.client_state == WebSocketState.CONNECTED:
+            data = await websocket.receive_json()
+            if data.get("cancel"):
+                if session.cancel(data.get("request_id")):
+                    await session.send_json({"request_id": data.get("request_id"), "cancelled": True})
+                continue
+            session.start(
+                data.get("request_id"),
+                lambda channel, data=data: process_websocket_message_openai(channel, data, client)
+            )
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected")
     except Exception as e:
         logger.error(f"Unexpected error in WebSocket connection: {str(e)}")
         logger.exception("Full traceback:")
     finally:
+        await session.close()
         logger.info("WebSocket connection closed")
         if websocket.client_state == WebSocketState.CONNECTED:
             await websocket.close()
@@ -0,0 +1,24 @@
+# backend/tests/test_admission.py
+import asyncio
+import pytest
+import utils.admission_utils as admission_utils
+from utils.admission_utils import admit, ServerBusyError
+
+def test_timed_out_wait_keeps_every_slot(monkeypatch):
+    async def run():
+        monkeypatch.setattr(admission_utils, "_semaphore", asyncio.Semaphore(1))
+        monkeypatch.setattr(admission_utils, "ADMISSION_TIMEOUT", 0.01)
+        monkeypatch.setattr(admission_utils, "ADMISSION_QUEUE_SIZE", 10)
+
+        async with admit():
+            for _ in range(20):
+                with pytest.raises(ServerBusyError):
+                    async with admit():
+                        pass
+
+        async with admit():
+            pass
+        assert admission_utils._semaphore._value == 1
+        assert admission_utils._active == 0 and admission_utils._waiting == 0
+
+    asyncio.run(run())
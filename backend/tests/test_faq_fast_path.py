@@ -0,0 +1,68 @@
+# backend/tests/test_faq_fast_path.py
+import asyncio
+import numpy as np
+import utils.websocket_utils as websocket_utils
+from utils.context_utils import cosine_distance
+from utils.pipeline_utils import StageExecutor, DeferredSender
+
+QUESTION = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+
+def faq_row(score, embedding):
+    # document_table_id, document_page, faq_no, chunk_text, score, file_path, file_name, embedding
+    return (1, 3, 7, "FAQ answer", score, "/faq/a.pdf", "a.pdf", np.asarray(embedding, dtype=np.float32))
+
+def find_match(monkeypatch, row, threshold=0.1):
+    async def execute_search_query(question_vector, category, top_n, table_name, excluded_pages=None):
+        return [row]
+
+    async def embedding():
+        return QUESTION
+
+    async def run():
+        async with StageExecutor() as stages:
+            stages.start("embedding", embedding())
+            match = await websocket_utils.find_faq_match(1, stages)
+            await stages.result("embedding")
+            return match
+
+    monkeypatch.setattr(websocket_utils, "execute_search_query", execute_search_query)
+    monkeypatch.setattr(websocket_utils, "format_result", lambda result, category, document_type: {"chunk_text": result[3]})
+    monkeypatch.setattr(websocket_utils, "FAQ_FAST_PATH_DISTANCE", threshold)
+    return asyncio.run(run())
+
+def test_cosine_distance():
+    assert cosine_distance(QUESTION, [2.0, 0.0, 0.0]) == 0.0
+    assert abs(cosine_distance(QUESTION, [0.0, 1.0, 0.0]) - 1.0) < 1e-6
+    assert cosine_distance(QUESTION, [0.0, 0.0, 0.0]) == 1.0
+
+def test_inner_product_score_does_not_trigger_fast_path(monkeypatch):
+    # With OPERATOR "<#>" an unrelated FAQ still scores below the threshold (negative inner product)
+    assert find_match(monkeypatch, faq_row(-0.05, [0.1, 0.995, 0.0])) is None
+
+def test_close_faq_triggers_fast_path(monkeypatch):
+    result, distance = find_match(monkeypatch, faq_row(-0.99, [0.99, 0.14, 0.0]))
+    assert result["chunk_text"] == "FAQ answer"
+    assert distance < 0.1
+
+def test_zero_threshold_disables_fast_path(monkeypatch):
+    assert find_match(monkeypatch, faq_row(-1.0, [1.0, 0.0, 0.0]), threshold=0) is None
+
+def test_deferred_sender_keeps_order():
+    class WebSocket:
+        def __init__(self):
+            self.sent = []
+
+        async def send_json(self, data):
+            self.sent.append(data)
+
+    async def run():
+        websocket = WebSocket()
+        sender = DeferredSender(websocket)
+        await sender.send_json({"n": 1})
+        await sender.send_json({"n": 2})
+        assert websocket.sent == []
+        await sender.release()
+        await sender.send_json({"n": 3})
+        return websocket.sent
+
+    assert asyncio.run(run()) == [{"n": 1}, {"n": 2}, {"n": 3}]
@@ -0,0 +1,32 @@
+# backend/tests/test_select_diverse.py
+import numpy as np
+import utils.context_utils as context_utils
+from utils.context_utils import select_diverse
+
+QUESTION = [1.0, 0.0, 0.0]
+
+def count_dropped(monkeypatch, embeddings, top_n, context_embeddings=None):
+    counts = []
+    monkeypatch.setattr(context_utils, "increment", lambda name, value=1: counts.append(value))
+    monkeypatch.setattr(context_utils, "DEDUP_SIMILARITY_THRESHOLD", 0.95)
+    monkeypatch.setattr(context_utils, "MMR_LAMBDA", 0.7)
+    selected = select_diverse(QUESTION, np.array(embeddings, dtype=np.float32), top_n, context_embeddings)
+    return selected, sum(counts)
+
+def test_duplicates_of_picks_are_counted_once(monkeypatch):
+    embeddings = [[1.0, 0.0, 0.0], [1.0, 0.01, 0.0], [1.0, 0.0, 0.01], [0.6, 0.8, 0.0]]
+    selected, dropped = count_dropped(monkeypatch, embeddings, top_n=3)
+    assert selected == [0, 3]
+    assert dropped == 2
+
+def test_candidates_left_over_after_top_n_are_not_counted(monkeypatch):
+    embeddings = [[1.0, 0.0, 0.0], [1.0, 0.01, 0.0], [0.6, 0.8, 0.0]]
+    selected, dropped = count_dropped(monkeypatch, embeddings, top_n=1)
+    assert selected == [0]
+    assert dropped == 0
+
+def test_duplicates_of_existing_context_are_counted(monkeypatch):
+    embeddings = [[1.0, 0.0, 0.0], [0.6, 0.8, 0.0]]
+    selected, dropped = count_dropped(monkeypatch, embeddings, top_n=2, context_embeddings=np.array([[1.0, 0.0, 0.0]]))
+    assert selected == [1]
+    assert dropped == 1
@@ -0,0 +1,46 @@
+# backend/tests/test_session.py
+import asyncio
+import json
+from utils.session_utils import WebSocketSession
+
+class FakeWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, text):
+        self.frames.append(text)
+
+def run_session(handler, cancel=False):
+    async def run():
+        websocket = FakeWebSocket()
+        session = WebSocketSession(websocket)
+        session.start("q1", handler)
+        await asyncio.sleep(0)
+        if cancel:
+            session.cancel("q1")
+        await session.close()
+        await asyncio.sleep(0)
+        return websocket.frames
+
+    return asyncio.run(run())
+
+def test_request_end_follows_answer():
+    async def handler(channel):
+        await channel.send_json({"ai_response_end": True})
+
+    frames = run_session(handler)
+    assert frames == ['{"request_id":"q1","ai_response_end":true}', '{"request_id":"q1","request_end":true}']
+
+def test_request_end_follows_failure():
+    async def handler(channel):
+        await channel.send_json({"error": "failed"})
+        raise RuntimeError("failed")
+
+    frames = run_session(handler)
+    assert [json.loads(frame) for frame in frames][-1] == {"request_id": "q1", "request_end": True}
+
+def test_no_request_end_when_cancelled():
+    async def handler(channel):
+        await asyncio.sleep(10)
+
+    assert run_session(handler, cancel=True) == []
@@ -0,0 +1,59 @@
+# backend/utils/admission_utils.py
+import asyncio
+import time
+import logging
+from contextlib import asynccontextmanager
+from .metrics_utils import increment, observe, set_gauge
+from config import DB_POOL_MAX_SIZE, ADMISSION_QUEUE_SIZE, ADMISSION_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "現在サーバーが混雑しています。しばらくしてから再度お試しください。"
+
+class ServerBusyError(Exception):
+    pass
+
+# One slot per pool connection: only a saturated pool makes queries queue, and only a full queue rejects them
+_semaphore = asyncio.Semaphore(DB_POOL_MAX_SIZE)
+_active = 0
+_waiting = 0
+
+def _update_gauges():
+    set_gauge("admission_active", _active)
+    set_gauge("admission_waiting", _waiting)
+
+@asynccontextmanager
+async def admit():
+    """Reserve a database connection slot, waiting in a bounded queue or failing fast with ServerBusyError."""
+    global _active, _waiting
+
+    if _semaphore.locked() and _waiting >= ADMISSION_QUEUE_SIZE:
+        increment("admission_rejected")
+        logger.warning(f"Admission rejected: {_active} active, {_waiting} waiting")
+        raise ServerBusyError(BUSY_MESSAGE)
+
+    _waiting += 1
+    _update_gauges()
+    start = time.perf_counter()
+    try:
+        # Unlike wait_for, the timeout cancels the acquire itself, so a permit is never taken after giving up
+        async with asyncio.timeout(ADMISSION_TIMEOUT):
+            await _semaphore.acquire()
+    except TimeoutError:
+        increment("admission_timeouts")
+        logger.warning(f"Admission timed out after {ADMISSION_TIMEOUT}s")
+        raise ServerBusyError(BUSY_MESSAGE)
+    finally:
+        _waiting -= 1
+        observe("admission_wait_ms", (time.perf_counter() - start) * 1000)
+        _update_gauges()
+
+    _active += 1
+    increment("admission_admitted")
+    _update_gauges()
+    try:
+        yield
+    finally:
+        _active -= 1
+        _semaphore.release()
+        _update_gauges()
@@ -0,0 +1,88 @@
+# backend/utils/answer_cache_utils.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+import numpy as np
+from .metrics_utils import increment, set_gauge
+from config import *
+
+logger = logging.getLogger(__name__)
+
+# (category, entry id) -> entry; entry: vector, messages, document version, created_at
+_answers = OrderedDict()
+_answer_lock = asyncio.Lock()
+_next_entry_id = 0
+
+class AnswerRecorder:
+    """Wraps the websocket and keeps a copy of every message sent while answering a question."""
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+        self.messages = []
+        self.failed = False
+
+    async def send_json(self, data):
+        self.messages.append(data)
+        if "error" in data:
+            self.failed = True
+        await self._websocket.send_json(data)
+
+    def __getattr__(self, name):
+        return getattr(self._websocket, name)
+
+def unit_vector(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+def is_expired(entry, version):
+    return entry["version"] != version or time.time() - entry["created_at"] > ANSWER_CACHE_TTL
+
+async def find_cached_answer(question_vector, category, version):
+    """Return (entry, similarity) for the closest answered question above ANSWER_CACHE_SIMILARITY, or (None, None).
+
+    version is the current document cache version (a digest of document checksums).
+    """
+    category = int(category)
+    async with _answer_lock:
+        # Answers built on documents that have since changed are never replayed
+        for key in [key for key, entry in _answers.items() if is_expired(entry, version)]:
+            del _answers[key]
+        set_gauge("answer_cache.size", len(_answers))
+
+        keys = [key for key in _answers if key[0] == category]
+        if not keys:
+            increment("answer_cache.miss")
+            return None, None
+
+        matrix = np.stack([_answers[key]["vector"] for key in keys])
+        similarities = matrix @ unit_vector(question_vector)
+        best = int(np.argmax(similarities))
+        if similarities[best] < ANSWER_CACHE_SIMILARITY:
+            increment("answer_cache.miss")
+            return None, None
+
+        _answers.move_to_end(keys[best])
+        increment("answer_cache.hit")
+        return _answers[keys[best]], float(similarities[best])
+
+async def store_answer(question_vector, category, messages, version):
+    global _next_entry_id
+    async with _answer_lock:
+        _next_entry_id += 1
+        _answers[(int(category), _next_entry_id)] = {
+            "vector": unit_vector(question_vector),
+            "messages": list(messages),
+            "version": version,
+            "created_at": time.time()
+        }
+        while len(_answers) > ANSWER_CACHE_SIZE:
+            _answers.popitem(last=False)
+        set_gauge("answer_cache.size", len(_answers))
+
+async def replay_answer(websocket, entry, similarity):
+    await websocket.send_json({"answer_cache": {"similarity": similarity}})
+    for message in entry["messages"]:
+        await websocket.send_json(message)
+    logger.info(f"Replayed cached answer ({len(entry['messages'])} messages, similarity {similarity:.4f})")
@@ -0,0 +1,85 @@
+# backend/utils/coalescing_utils.py
+import asyncio
+import logging
+from .metrics_utils import increment, set_gauge
+
+logger = logging.getLogger(__name__)
+
+_flights = {}
+
+class Flight:
+    """One in-flight pipeline execution shared by every identical request.
+
+    The pipeline sends its messages to the flight instead of a websocket; each subscriber
+    streams the message log from the start, so a request joining late still gets the whole answer.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.messages = []
+        self.done = False
+        self.subscribers = 0
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    async def send_json(self, data):
+        async with self._changed:
+            self.messages.append(data)
+            self._changed.notify_all()
+
+    async def finish(self):
+        async with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+    async def stream_to(self, websocket):
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.messages) > sent or self.done)
+                pending = self.messages[sent:]
+                done = self.done
+            for message in pending:
+                await websocket.send_json(message)
+            sent += len(pending)
+            if done and not pending:
+                return
+
+def _forget(flight):
+    if _flights.get(flight.key) is flight:
+        del _flights[flight.key]
+        set_gauge("coalescing.in_flight", len(_flights))
+
+async def _run_flight(flight, pipeline):
+    try:
+        await pipeline(flight)
+    finally:
+        _forget(flight)
+        await flight.finish()
+
+async def run_coalesced(key, websocket, pipeline):
+    """Stream the result of pipeline(flight) to websocket, sharing one execution per key.
+
+    The first request for a key starts the pipeline; identical requests arriving while it runs
+    subscribe to it. The pipeline is cancelled when its last subscriber goes away.
+    """
+    flight = _flights.get(key)
+    if flight is None:
+        flight = Flight(key)
+        _flights[key] = flight
+        flight.task = asyncio.create_task(_run_flight(flight, pipeline))
+        increment("coalescing.leader")
+        set_gauge("coalescing.in_flight", len(_flights))
+    else:
+        increment("coalescing.follower")
+        logger.info(f"Joined in-flight request ({flight.subscribers} other subscribers)")
+
+    flight.subscribers += 1
+    try:
+        await flight.stream_to(websocket)
+    finally:
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.task.done():
+            _forget(flight)
+            flight.task.cancel()
+            logger.info("Cancelled in-flight request with no subscribers left")
@@ -0,0 +1,172 @@
+# backend/utils/context_utils.py
+import functools
+import logging
+import numpy as np
+import tiktoken
+from .search_backends import score_matrix, to_numpy_vector
+from .metrics_utils import increment
+from config import *
+
+logger = logging.getLogger(__name__)
+
+class CharacterEncoding:
+    """Fallback when the tiktoken encoding file cannot be loaded: one token per character.
+
+    Japanese text averages close to one token per character, so budgets stay conservative.
+    """
+
+    name = "characters"
+
+    def encode(self, text):
+        return list(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+@functools.lru_cache(maxsize=None)
+def get_token_encoding():
+    # tiktoken downloads the encoding once and caches it (TIKTOKEN_CACHE_DIR); call this at startup
+    try:
+        return tiktoken.get_encoding(CONTEXT_TOKEN_ENCODING)
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding {CONTEXT_TOKEN_ENCODING} ({e}); counting characters instead")
+        return CharacterEncoding()
+
+def count_tokens(text):
+    return len(get_token_encoding().encode(text))
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+def cosine_distance(question_vector, embedding):
+    question_vector = np.asarray(question_vector, dtype=np.float32)
+    embedding = np.asarray(embedding, dtype=np.float32)
+    norms = np.linalg.norm(question_vector) * np.linalg.norm(embedding)
+    return float(1 - question_vector @ embedding / norms) if norms > 0 else 1.0
+
+def select_diverse(question_vector, embeddings, top_n, context_embeddings=None):
+    """Maximal marginal relevance over search candidates.
+
+    Each step picks the candidate with the best MMR_LAMBDA * relevance - (1 - MMR_LAMBDA) * redundancy,
+    where redundancy is the highest cosine similarity to the context already chosen (context_embeddings
+    and earlier picks). Candidates at DEDUP_SIMILARITY_THRESHOLD or above are dropped as near-duplicates.
+    Returns candidate positions in selection order.
+    """
+    if len(embeddings) == 0:
+        return []
+    candidates = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    relevance = candidates @ normalize_rows(np.asarray(question_vector, dtype=np.float32))
+
+    redundancy = np.zeros(len(candidates), dtype=np.float32)
+    if context_embeddings is not None and len(context_embeddings):
+        context = normalize_rows(np.asarray(context_embeddings, dtype=np.float32))
+        redundancy = np.maximum(redundancy, (candidates @ context.T).max(axis=1))
+
+    # Only candidates that were still in the running when they turned out to be near-duplicates count as dropped
+    duplicates = redundancy >= DEDUP_SIMILARITY_THRESHOLD
+    available = ~duplicates
+    selected = []
+    while len(selected) < top_n and available.any():
+        scores = np.where(available, MMR_LAMBDA * relevance - (1 - MMR_LAMBDA) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        if len(selected) == top_n:
+            break
+        redundancy = np.maximum(redundancy, candidates @ candidates[best])
+        new_duplicates = available & (redundancy >= DEDUP_SIMILARITY_THRESHOLD)
+        duplicates |= new_duplicates
+        available &= ~new_duplicates
+
+    if duplicates.any():
+        increment("context_duplicates_dropped", int(duplicates.sum()))
+    return selected
+
+def take_within_budget(texts, budget):
+    """Keep ranked texts while they fit the token budget; the first one that overflows is cut to the remainder.
+
+    Returns the kept texts (positions preserved, dropped ones as None) and the tokens used.
+    """
+    encoding = get_token_encoding()
+    kept = [None] * len(texts)
+    used = 0
+    for i, text in enumerate(texts):
+        tokens = encoding.encode(text)
+        if used + len(tokens) <= budget:
+            kept[i] = text
+            used += len(tokens)
+            continue
+        remaining = budget - used
+        if remaining > 0:
+            kept[i] = encoding.decode(tokens[:remaining])
+            used += remaining
+        break
+    return kept, used
+
+def build_toc_context(toc_texts):
+    """Fit the category's TOC files into the toc budget, keeping each file's header and leading rows."""
+    budget = CONTEXT_TOKEN_BUDGETS["toc"]
+    per_file_budget = budget // len(toc_texts) if toc_texts else 0
+    parts = []
+    used = 0
+    for toc_text in toc_texts:
+        lines = toc_text.splitlines()
+        kept_lines, file_used = [], 0
+        for line in lines:
+            line_tokens = count_tokens(line) + 1
+            if file_used + line_tokens > per_file_budget:
+                break
+            kept_lines.append(line)
+            file_used += line_tokens
+        if len(kept_lines) < len(lines):
+            logger.debug(f"TOC trimmed to {len(kept_lines)} of {len(lines)} lines")
+        parts.append("\n".join(kept_lines))
+        used += file_used
+
+    report_token_counts({"toc": used})
+    return "\n\n".join(parts), used
+
+def build_final_context(question_vector, page_chunks, manual_texts, faq_texts):
+    """Assemble the final prompt's reference texts within the per-source token budgets.
+
+    page_chunks holds, per page range, (document_page, chunk_no, chunk_text, embedding) rows.
+    The range chunks most similar to the question are kept and put back in page order.
+    """
+    flat_chunks = [
+        (range_index, chunk)
+        for range_index, chunks in enumerate(page_chunks)
+        for chunk in chunks
+    ]
+    page_texts = ["" for _ in page_chunks]
+    page_used = 0
+    if flat_chunks:
+        matrix = np.array([to_numpy_vector(chunk[3]) for _, chunk in flat_chunks], dtype=np.float32)
+        order = np.argsort(score_matrix(matrix, question_vector), kind="stable")
+        kept, page_used = take_within_budget([flat_chunks[i][1][2] for i in order], CONTEXT_TOKEN_BUDGETS["page"])
+
+        selected = {}
+        for position, text in zip(order, kept):
+            if text is not None:
+                range_index, chunk = flat_chunks[position]
+                selected.setdefault(range_index, []).append((chunk[0], chunk[1], text))
+        for range_index, chunks in selected.items():
+            page_texts[range_index] = " ".join(text for _, _, text in sorted(chunks))
+
+    kept_manual, manual_used = take_within_budget(manual_texts, CONTEXT_TOKEN_BUDGETS["manual"])
+    kept_faq, faq_used = take_within_budget(faq_texts, CONTEXT_TOKEN_BUDGETS["faq"])
+
+    token_counts = {"page": page_used, "manual": manual_used, "faq": faq_used}
+    token_counts["total"] = sum(token_counts.values())
+    report_token_counts(token_counts)
+    return (
+        page_texts,
+        [text for text in kept_manual if text is not None],
+        [text for text in kept_faq if text is not None],
+        token_counts
+    )
+
+def report_token_counts(token_counts):
+    for source, tokens in token_counts.items():
+        increment(f"context_tokens.{source}", tokens)
+    logger.info(f"Context tokens: {token_counts}")
@@ -1,88 +1,308 @@
 # backend/utils/db_utils.py
+import psycopg
 import psycopg_pool
+import numpy as np
 from psycopg import sql
+from pgvector import HalfVector
+from pgvector.psycopg import register_vector_async
+import asyncio
+import functools
+import json
 import logging
+import random
+import time
+from .metrics_utils import observe, increment
+from .admission_utils import admit, ServerBusyError, BUSY_MESSAGE
 from config import *
 
 logger = logging.getLogger(__name__)
 
-# Create a connection pool
-pool = psycopg_pool.ConnectionPool(
+# Set from the installed extension version when the first pooled connection is configured
+_iterative_scan_enabled = False
+
+async def supports_iterative_scan(conn):
+    cur = await conn.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    row = await cur.fetchone()
+    if row is None:
+        return False
+    return tuple(int(part) for part in row[0].split(".")[:2]) >= (0, 8)
+
+async def configure_connection(conn):
+    global _iterative_scan_enabled
+    # Session settings are applied once per pooled connection instead of before every statement
+    await conn.set_autocommit(True)
+    await register_vector_async(conn)
+    if INDEX_TYPE == "hnsw":
+        await conn.execute(sql.SQL("SET hnsw.ef_search = {}").format(sql.Literal(HNSW_EF_SEARCH)))
+        if HNSW_ITERATIVE_SCAN != "off":
+            # Keeps filtered scans from returning fewer than LIMIT rows; the settings only exist in pgvector 0.8.0+
+            if await supports_iterative_scan(conn):
+                await conn.execute(sql.SQL("SET hnsw.iterative_scan = {}").format(sql.SQL(HNSW_ITERATIVE_SCAN)))
+                await conn.execute(sql.SQL("SET hnsw.max_scan_tuples = {}").format(sql.Literal(HNSW_MAX_SCAN_TUPLES)))
+                _iterative_scan_enabled = True
+            elif not _iterative_scan_enabled:
+                logger.warning("pgvector is older than 0.8.0; under-filled filtered searches fall back to an exact category scan")
+
+# Create a connection pool (opened in the FastAPI lifespan)
+pool = psycopg_pool.AsyncConnectionPool(
     f"dbname={POSTGRES_DB} user={POSTGRES_USER} password={POSTGRES_PASSWORD} host={POSTGRES_HOST} port={POSTGRES_PORT}",
-    min_size=1,
-    max_size=10
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    configure=configure_connection,
+    open=False
 )
 
-def get_db_connection():
-    return pool
+async def open_db_pool():
+    await pool.open()
+    logger.info("Database connection pool opened")
+
+async def close_db_pool():
+    await pool.close()
+    logger.info("Database connection pool closed")
+
+def get_pool_metrics():
+    stats = pool.get_stats()
+    in_use = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+    stats["pool_in_use"] = in_use
+    stats["pool_saturation"] = in_use / DB_POOL_MAX_SIZE if DB_POOL_MAX_SIZE else 0.0
+    return stats
+
+async def execute_query(query, params=None, prepare=None):
+    # Connections are checked out per query so idle sockets never pin one, and admission is held
+    # only for the checkout, not while a question waits on the LLM
+    start = time.perf_counter()
+    try:
+        async with admit(), pool.connection() as conn:
+            observe("db_pool_wait_ms", (time.perf_counter() - start) * 1000)
+            async with conn.cursor() as cur:
+                await cur.execute(query, params, prepare=prepare)
+                return await cur.fetchall()
+    except psycopg_pool.PoolTimeout:
+        increment("db_pool_timeouts")
+        logger.warning(f"Timed out after {DB_POOL_TIMEOUT}s waiting for a database connection")
+        raise ServerBusyError(BUSY_MESSAGE)
+
+_category_cache = {"categories": None, "loaded_at": 0.0, "refresh": None}
+_category_cache_lock = asyncio.Lock()
+
+async def get_available_categories():
+    """Categories from a TTL cache; for CATEGORY_CACHE_STALE seconds after expiry the old value is
+    returned while a background query refreshes it."""
+    age = time.monotonic() - _category_cache["loaded_at"]
+    if _category_cache["categories"] is not None:
+        if age < CATEGORY_CACHE_TTL:
+            return _category_cache["categories"]
+        if age < CATEGORY_CACHE_TTL + CATEGORY_CACHE_STALE:
+            if _category_cache["refresh"] is None or _category_cache["refresh"].done():
+                _category_cache["refresh"] = asyncio.create_task(refresh_available_categories())
+            increment("category_cache.stale")
+            return _category_cache["categories"]
 
-def execute_query(conn, query, params=None):
-    with conn.cursor() as cur:
-        if INDEX_TYPE == "hnsw":
-            cur.execute(f"SET hnsw.ef_search = {HNSW_EF_SEARCH};")
-        cur.execute(query, params)
-        return cur.fetchall()
+    async with _category_cache_lock:
+        if _category_cache["categories"] is None or time.monotonic() - _category_cache["loaded_at"] >= CATEGORY_CACHE_TTL:
+            await refresh_available_categories()
+    return _category_cache["categories"]
 
-def get_available_categories():
+async def refresh_available_categories():
     try:
-        with pool.connection() as conn:
-            query = sql.SQL("""
-                SELECT DISTINCT business_category
-                FROM {}
-                ORDER BY business_category
-            """).format(sql.Identifier(DOCUMENT_CATEGORY_TABLE))
-            categories = [row[0] for row in execute_query(conn, query)]
-            return {name: value for name, value in BUSINESS_CATEGORY_MAPPING.items() if value in categories}
+        categories = await load_available_categories()
+    except Exception as e:
+        if _category_cache["categories"] is None:
+            raise
+        logger.warning(f"Error refreshing available categories, keeping the cached ones: {e}")
+        return
+    _category_cache.update(categories=categories, loaded_at=time.monotonic())
+
+async def load_available_categories():
+    try:
+        query = sql.SQL("""
+            SELECT DISTINCT business_category
+            FROM {}
+            ORDER BY business_category
+        """).format(sql.Identifier(DOCUMENT_CATEGORY_TABLE))
+        categories = [row[0] for row in await execute_query(query)]
+        return {name: value for name, value in BUSINESS_CATEGORY_MAPPING.items() if value in categories}
     except psycopg_pool.PoolError as e:
         logger.error(f"Error fetching available categories: {e}")
         raise
 
-def get_search_query(index_type, table_name):
-    vector_type = "halfvec(3072)" if index_type == "hnsw" else "vector(3072)"
+SEARCH_COLUMNS = {
+    PDF_MANUAL_TABLE: "t.document_table_id, t.chunk_no, t.document_page, t.chunk_text",
+    PDF_FAQ_TABLE: "t.document_table_id, t.document_page, t.faq_no, t.chunk_text"
+}
+
+# Page ranges already used as context (pdf_info) are filtered out in the database
+EXCLUSION_FILTER = sql.SQL("""AND NOT EXISTS (
+                SELECT 1
+                FROM unnest(%(excluded_file_names)s::text[], %(excluded_start_pages)s::int[], %(excluded_end_pages)s::int[])
+                    AS ex(file_name, start_page, end_page)
+                WHERE ex.file_name = d.file_name
+                    AND t.document_page BETWEEN ex.start_page AND ex.end_page
+            )""")
+
+# First-stage distance expressions of the two-stage search strategies; each must match its batch index
+FIRST_STAGE_EXPRESSIONS = {
+    "binary_rerank": "binary_quantize(t.embedding)::bit(3072) <~> binary_quantize(%(query_vector)b::{vector_type})",
+    "short_rerank": f"t.embedding_short {{operator}} %(short_query_vector)b::halfvec({SHORT_EMBEDDING_DIMENSIONS})"
+}
+
+@functools.lru_cache(maxsize=None)
+def get_search_query(index_type, table_name, exact=False):
+    if table_name not in SEARCH_COLUMNS:
+        raise ValueError(f"Unsupported table name: {table_name}")
+    if SEARCH_STRATEGY == "short_rerank" and SHORT_EMBEDDING_DIMENSIONS <= 0:
+        raise ValueError("SEARCH_STRATEGY=short_rerank requires SHORT_EMBEDDING_DIMENSIONS > 0")
+
+    vector_type = "halfvec(3072)" if index_type == "hnsw" or EMBEDDING_STORAGE_TYPE == "halfvec" else "vector(3072)"
+    # A native halfvec column is scored as-is; a vector column is cast to match the index expression
+    embedding_expression = "t.embedding" if EMBEDDING_STORAGE_TYPE == "halfvec" else f"t.embedding::{vector_type}"
     operator = OPERATOR
 
-    if table_name == PDF_MANUAL_TABLE:
+    if exact:
+        # Small categories: materialize the category's rows first so the HNSW index is bypassed
+        # and every row of the category is scored exactly
         query = sql.SQL("""
-        SELECT t.document_table_id, t.chunk_no, t.document_page, t.chunk_text,
-                (t.embedding::{vector_type} {operator} %s::{vector_type}) AS distance
-        FROM {table} t
-        JOIN {document_category_table} c ON t.document_table_id = c.document_table_id
-        WHERE c.business_category = %s
+        WITH category_chunks AS MATERIALIZED (
+            SELECT t.*, d.file_path, d.file_name
+            FROM {table} t
+            JOIN {document_category_table} c ON t.document_table_id = c.document_table_id
+            JOIN {document_table} d ON t.document_table_id = d.id
+            WHERE c.business_category = %(category)s
+            {exclusion_filter}
+        )
+        SELECT {columns},
+                ({embedding_expression} {operator} %(query_vector)b::{vector_type}) AS distance,
+                t.file_path, t.file_name, t.embedding
+        FROM category_chunks t
         ORDER BY distance ASC
-        LIMIT %s;
+        LIMIT %(top_n)s;
         """)
-    elif table_name == PDF_FAQ_TABLE:
+    elif SEARCH_STRATEGY in FIRST_STAGE_EXPRESSIONS:
+        # A cheap first-stage index (binary-quantized or Matryoshka-truncated embeddings) picks
+        # a wider candidate set, which is then reranked by the exact distance on the full vectors
         query = sql.SQL("""
-        SELECT t.document_table_id, t.document_page, t.faq_no, t.chunk_text,
-                (t.embedding::{vector_type} {operator} %s::{vector_type}) AS distance
-        FROM {table} t
-        JOIN {document_category_table} c ON t.document_table_id = c.document_table_id
-        WHERE c.business_category = %s
+        WITH candidates AS MATERIALIZED (
+            SELECT {columns}, t.embedding, d.file_path, d.file_name,
+                    ({first_stage_expression}) AS first_stage_distance
+            FROM {table} t
+            JOIN {document_category_table} c ON t.document_table_id = c.document_table_id
+            JOIN {document_table} d ON t.document_table_id = d.id
+            WHERE c.business_category = %(category)s
+            {exclusion_filter}
+            ORDER BY first_stage_distance ASC
+            LIMIT %(candidate_n)s
+        )
+        SELECT {columns},
+                ({embedding_expression} {operator} %(query_vector)b::{vector_type}) AS distance,
+                t.file_path, t.file_name, t.embedding
+        FROM candidates t
         ORDER BY distance ASC
-        LIMIT %s;
+        LIMIT %(top_n)s;
         """)
     else:
-        raise ValueError(f"Unsupported table name: {table_name}")
+        # With hnsw.iterative_scan the index scan keeps going until the category filter
+        # has produced LIMIT rows; relaxed_order results are re-sorted by the outer query
+        query = sql.SQL("""
+        WITH relaxed_results AS MATERIALIZED (
+            SELECT {columns},
+                    ({embedding_expression} {operator} %(query_vector)b::{vector_type}) AS distance,
+                    d.file_path, d.file_name, t.embedding
+            FROM {table} t
+            JOIN {document_category_table} c ON t.document_table_id = c.document_table_id
+            JOIN {document_table} d ON t.document_table_id = d.id
+            WHERE c.business_category = %(category)s
+            {exclusion_filter}
+            ORDER BY distance ASC
+            LIMIT %(top_n)s
+        )
+        SELECT * FROM relaxed_results ORDER BY distance ASC;
+        """)
 
     return query.format(
+        first_stage_expression=sql.SQL(FIRST_STAGE_EXPRESSIONS.get(SEARCH_STRATEGY, "")).format(
+            vector_type=sql.SQL(vector_type),
+            operator=sql.SQL(operator)
+        ),
+        exclusion_filter=EXCLUSION_FILTER,
+        columns=sql.SQL(SEARCH_COLUMNS[table_name]),
         vector_type=sql.SQL(vector_type),
+        embedding_expression=sql.SQL(embedding_expression),
         operator=sql.SQL(operator),
         table=sql.Identifier(table_name),
-        document_category_table=sql.Identifier(DOCUMENT_CATEGORY_TABLE)
+        document_category_table=sql.Identifier(DOCUMENT_CATEGORY_TABLE),
+        document_table=sql.Identifier(DOCUMENT_TABLE)
     )
 
-def execute_search_query(conn, question_vector, category, top_n, table_name):
-    query = get_search_query(INDEX_TYPE, table_name)
-    results = execute_query(conn, query, (question_vector, int(category), top_n))
+_explain_tasks = set()
+
+async def sample_search_plan(query, params, table_name):
+    """Record the planning/execution split of an ad-hoc (unprepared) run of a search statement.
+
+    The served searches run prepared, so their planning is mostly skipped; these samples show
+    what a fresh plan costs and how the plan executes, not the latency of the prepared path.
+    """
+    try:
+        explain_query = sql.SQL("EXPLAIN (ANALYZE, FORMAT JSON) ") + query
+        plan = (await execute_query(explain_query, params))[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        observe(f"search_adhoc_plan.planning_ms.{table_name}", plan[0]["Planning Time"])
+        observe(f"search_adhoc_plan.execution_ms.{table_name}", plan[0]["Execution Time"])
+    except Exception as e:
+        logger.warning(f"Error sampling search plan for {table_name}: {e}")
+
+def to_short_query_vector(question_vector):
+    # Matryoshka truncation: the leading dimensions, renormalized to unit length
+    short_vector = np.asarray(question_vector, dtype=np.float32)[:SHORT_EMBEDDING_DIMENSIONS]
+    norm = np.linalg.norm(short_vector)
+    return HalfVector(short_vector / norm if norm > 0 else short_vector)
+
+def to_query_vector(question_vector):
+    # Sent in pgvector's binary wire format instead of a 3072-float text literal
+    question_vector = np.asarray(question_vector, dtype=np.float32)
+    return HalfVector(question_vector) if INDEX_TYPE == "hnsw" or EMBEDDING_STORAGE_TYPE == "halfvec" else question_vector
 
+async def use_exact_search(category, table_name):
+    cache = await get_document_cache()
+    return cache["chunk_counts"].get((table_name, int(category)), 0) <= EXACT_SEARCH_MAX_ROWS
+
+async def execute_pgvector_search(question_vector, category, top_n, table_name, excluded_pages=None):
+    exact = await use_exact_search(category, table_name)
+    # The statement is built once and prepared server-side on every pooled connection
+    query = get_search_query(INDEX_TYPE, table_name, exact)
+    excluded_pages = excluded_pages or []
+    params = {
+        "query_vector": to_query_vector(question_vector),
+        "category": int(category),
+        "excluded_file_names": [excluded['file_name'] for excluded in excluded_pages],
+        "excluded_start_pages": [excluded['start_page'] for excluded in excluded_pages],
+        "excluded_end_pages": [excluded['end_page'] for excluded in excluded_pages],
+        "top_n": top_n,
+        "candidate_n": top_n * HNSW_CANDIDATE_MULTIPLIER
+    }
+    if SEARCH_STRATEGY == "short_rerank" and not exact:
+        params["short_query_vector"] = to_short_query_vector(question_vector)
+
+    start = time.perf_counter()
+    results = await execute_query(query, params, prepare=True)
+    search_type = "exact" if exact else SEARCH_STRATEGY
+    observe(f"search_query_ms.{table_name}.{search_type}", (time.perf_counter() - start) * 1000)
     if len(results) < top_n:
-        additional_query = get_search_query(INDEX_TYPE, table_name)
-        additional_results = execute_query(conn, additional_query, (question_vector, int(category), top_n - len(results)))
-        results.extend(additional_results)
+        increment(f"search_underfilled.{table_name}.{search_type}")
+        if not exact and not _iterative_scan_enabled:
+            # Without iterative scans the category filter can leave fewer than LIMIT index candidates
+            increment(f"search_exact_fallback.{table_name}")
+            results = await execute_query(get_search_query(INDEX_TYPE, table_name, True), params, prepare=True)
+
+    if SEARCH_EXPLAIN_SAMPLE_RATE > 0 and random.random() < SEARCH_EXPLAIN_SAMPLE_RATE:
+        task = asyncio.create_task(sample_search_plan(query, params, table_name))
+        _explain_tasks.add(task)
+        task.add_done_callback(_explain_tasks.discard)
 
     return results[:top_n]
 
-def get_toc_data(conn, category):
+async def get_toc_data(category):
     try:
         query = sql.SQL("""
             SELECT xt.toc_data
@@ -96,65 +316,167 @@ def get_toc_data(conn, category):
             document_category_table=sql.Identifier(DOCUMENT_CATEGORY_TABLE)
         )
 
-        results = execute_query(conn, query, (category,))
+        results = await execute_query(query, (category,))
 
         if not results:
             logger.warning(f"No TOC data found for category: {category}")
-            return ""
-
-        # 複数のTOC dataを結合
-        all_toc_data = "\n\n".join([result[0] for result in results])
+            return []
 
-        return all_toc_data
+        # TOC data per file; the context builder fits them into the token budget
+        return [result[0] for result in results]
     except Exception as e:
         logger.error(f"Error fetching TOC data for category {category}: {e}")
-        return ""
+        return []
 
-def get_chunk_text_for_pages(conn, document_table_id, start_page, end_page):
+async def load_toc_entries(category):
     query = sql.SQL("""
-    SELECT chunk_text
-    FROM {table}
-    WHERE document_table_id = %s AND document_page BETWEEN %s AND %s
-    ORDER BY document_page, chunk_no
+    SELECT e.pdf_file_name, e.start_page, e.end_page, e.chapter, e.section, e.embedding
+    FROM {xlsx_toc_entry_table} e
+    JOIN {document_category_table} dct ON e.document_table_id = dct.document_table_id
+    WHERE dct.business_category = %s
+    ORDER BY e.document_table_id, e.entry_no
+    """).format(
+        xlsx_toc_entry_table=sql.Identifier(XLSX_TOC_ENTRY_TABLE),
+        document_category_table=sql.Identifier(DOCUMENT_CATEGORY_TABLE)
+    )
+    try:
+        return await execute_query(query, (category,))
+    except psycopg.errors.UndefinedTable:
+        logger.warning(f"{XLSX_TOC_ENTRY_TABLE} does not exist yet; run toc_to_aurora.py to create TOC entries")
+        return []
+
+async def get_chunks_for_pages(page_ranges):
+    """Fetch the chunks of every (document_table_id, start_page, end_page) in one round trip.
+
+    Returns, per page range, (document_page, chunk_no, chunk_text, embedding) rows in page order.
+    """
+    lookups = [(index, page_range) for index, page_range in enumerate(page_ranges) if page_range[0] is not None]
+    page_chunks = [[] for _ in page_ranges]
+    if not lookups:
+        return page_chunks
+
+    query = sql.SQL("""
+    SELECT r.ord, t.document_page, t.chunk_no, t.chunk_text, t.embedding
+    FROM unnest(%s::uuid[], %s::int[], %s::int[]) WITH ORDINALITY AS r(document_table_id, start_page, end_page, ord)
+    JOIN {table} t ON t.document_table_id = r.document_table_id
+        AND t.document_page BETWEEN r.start_page AND r.end_page
+    ORDER BY r.ord, t.document_page, t.chunk_no
     """).format(table=sql.Identifier(PDF_MANUAL_TABLE))
 
-    results = execute_query(conn, query, (document_table_id, start_page, end_page))
-    return ' '.join([result[0] for result in results])
+    params = (
+        [page_range[0] for _, page_range in lookups],
+        [page_range[1] for _, page_range in lookups],
+        [page_range[2] for _, page_range in lookups]
+    )
+    for ord_no, document_page, chunk_no, chunk_text, embedding in await execute_query(query, params):
+        page_chunks[lookups[ord_no - 1][0]].append((document_page, chunk_no, chunk_text, embedding))
+    return page_chunks
+
+async def get_document_version():
+    query = sql.SQL("""
+    SELECT COUNT(*), md5(COALESCE(string_agg(id::text || checksum, ',' ORDER BY id), ''))
+    FROM {}
+    """).format(sql.Identifier(DOCUMENT_TABLE))
+
+    count, checksum_digest = (await execute_query(query))[0]
+    return f"{count}:{checksum_digest}"
 
-def get_document_id(conn, file_name, category):
+async def load_chunk_counts():
+    chunk_counts = {}
+    for table_name in [PDF_MANUAL_TABLE, PDF_FAQ_TABLE]:
+        query = sql.SQL("""
+        SELECT c.business_category, COUNT(*)
+        FROM {table} t
+        JOIN {document_category_table} c ON t.document_table_id = c.document_table_id
+        GROUP BY c.business_category
+        """).format(
+            table=sql.Identifier(table_name),
+            document_category_table=sql.Identifier(DOCUMENT_CATEGORY_TABLE)
+        )
+        for business_category, count in await execute_query(query):
+            chunk_counts[(table_name, business_category)] = count
+    return chunk_counts
+
+async def load_document_chunks(table_name, document_table_ids):
     query = sql.SQL("""
-    SELECT dt.id
+    SELECT {columns}, t.embedding
+    FROM {table} t
+    WHERE t.document_table_id = ANY(%s)
+    ORDER BY t.document_table_id, t.chunk_no
+    """).format(
+        columns=sql.SQL(SEARCH_COLUMNS[table_name]),
+        table=sql.Identifier(table_name)
+    )
+    return await execute_query(query, (list(document_table_ids),))
+
+async def load_document_metadata():
+    query = sql.SQL("""
+    SELECT dt.id, dt.file_path, dt.file_name, dt.document_type, dt.checksum, dct.business_category
     FROM {document_table} dt
-    JOIN {document_category_table} dct ON dt.id = dct.document_table_id
-    WHERE dt.file_name = %s AND dct.business_category = %s
+    LEFT JOIN {document_category_table} dct ON dt.id = dct.document_table_id
     """).format(
         document_table=sql.Identifier(DOCUMENT_TABLE),
         document_category_table=sql.Identifier(DOCUMENT_CATEGORY_TABLE)
     )
 
-    result = execute_query(conn, query, (file_name, category))
-    return result[0][0] if result else None
+    documents = {}
+    document_ids_by_name = {}
+    for document_table_id, file_path, file_name, document_type, checksum, business_category in await execute_query(query):
+        document = documents.setdefault(document_table_id, {
+            "file_path": file_path,
+            "file_name": file_name,
+            "document_type": document_type,
+            "checksum": checksum,
+            "categories": []
+        })
+        if business_category is not None:
+            document["categories"].append(business_category)
+            document_ids_by_name.setdefault((file_name, business_category), document_table_id)
+    return documents, document_ids_by_name
 
-def get_document_info(conn, document_table_id):
-    query = sql.SQL("""
-    SELECT file_path, file_name FROM {} WHERE id = %s
-    """).format(sql.Identifier(DOCUMENT_TABLE))
+_document_cache = {"version": None, "checked_at": 0.0, "documents": {}, "document_ids_by_name": {}, "chunk_counts": {}}
+_document_cache_lock = asyncio.Lock()
+
+async def get_document_cache():
+    """Return the in-process document metadata, reloading it when document_table has changed."""
+    if time.monotonic() - _document_cache["checked_at"] < DOCUMENT_CACHE_CHECK_INTERVAL:
+        return _document_cache
+
+    async with _document_cache_lock:
+        if time.monotonic() - _document_cache["checked_at"] < DOCUMENT_CACHE_CHECK_INTERVAL:
+            return _document_cache
+
+        version = await get_document_version()
+        if version != _document_cache["version"]:
+            documents, document_ids_by_name = await load_document_metadata()
+            chunk_counts = await load_chunk_counts()
+            _document_cache.update(
+                documents=documents,
+                document_ids_by_name=document_ids_by_name,
+                chunk_counts=chunk_counts,
+                version=version
+            )
+            increment("document_cache_reloads")
+            logger.info(f"Document metadata cache loaded: {len(documents)} documents (version {version})")
+        _document_cache["checked_at"] = time.monotonic()
+    return _document_cache
 
-    result = execute_query(conn, query, (document_table_id,))
-    return result[0] if result else (None, None)
+async def get_document_id(file_name, category):
+    cache = await get_document_cache()
+    return cache["document_ids_by_name"].get((file_name, int(category)))
 
 def get_category_name(category_id):
     return next((name for name, value in BUSINESS_CATEGORY_MAPPING.items() if value == category_id), None)
 
-def format_result(conn, result, category, document_type):
+def format_result(result, category, document_type):
+    # Search rows end with the chunk embedding, which is not part of the formatted result
     if document_type == "manual":
-        document_table_id, chunk_no, document_page, chunk_text, distance = result
+        document_table_id, chunk_no, document_page, chunk_text, distance, file_path, file_name = result[:7]
     elif document_type == "faq":
-        document_table_id, document_page, faq_no, chunk_text, distance = result
+        document_table_id, document_page, faq_no, chunk_text, distance, file_path, file_name = result[:7]
     else:
         raise ValueError(f"Invalid document type: {document_type}")
 
-    file_path, file_name = get_document_info(conn, document_table_id)
     category_name = get_category_name(category)
 
     formatted_result = {
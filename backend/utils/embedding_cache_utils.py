@@ -0,0 +1,125 @@
+# backend/utils/embedding_cache_utils.py
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from .metrics_utils import increment, set_gauge
+from config import *
+
+logger = logging.getLogger(__name__)
+
+_memory_cache = OrderedDict()
+_memory_lock = threading.Lock()
+_disk_lock = threading.Lock()
+_disk_connection = None
+
+def normalize_question(question):
+    """Key for verbatim repeats: NFKC (full/half-width), case-folded, whitespace collapsed."""
+    normalized = unicodedata.normalize("NFKC", question).casefold()
+    return re.sub(r"\s+", " ", normalized).strip()
+
+def get_cache_key(question):
+    # The deployment is part of the key, so switching embedding models never serves stale vectors
+    return f"{AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT}\n{normalize_question(question)}"
+
+def get_disk_connection():
+    global _disk_connection
+    if _disk_connection is None:
+        os.makedirs(os.path.dirname(EMBEDDING_CACHE_PATH) or ".", exist_ok=True)
+        _disk_connection = sqlite3.connect(EMBEDDING_CACHE_PATH, check_same_thread=False)
+        _disk_connection.execute("PRAGMA journal_mode=WAL")
+        _disk_connection.execute("""
+        CREATE TABLE IF NOT EXISTS question_embeddings (
+            cache_key TEXT PRIMARY KEY,
+            vector BLOB NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """)
+        _disk_connection.execute("DELETE FROM question_embeddings WHERE created_at < ?", (time.time() - EMBEDDING_CACHE_TTL,))
+        _disk_connection.commit()
+        logger.info(f"Embedding cache persisted at {EMBEDDING_CACHE_PATH}")
+    return _disk_connection
+
+def read_disk_entry(cache_key):
+    with _disk_lock:
+        row = get_disk_connection().execute(
+            "SELECT vector, created_at FROM question_embeddings WHERE cache_key = ?", (cache_key,)
+        ).fetchone()
+    if row is None or time.time() - row[1] > EMBEDDING_CACHE_TTL:
+        return None
+    return np.frombuffer(row[0], dtype=np.float32), row[1]
+
+def write_disk_entry(cache_key, vector, created_at):
+    with _disk_lock:
+        connection = get_disk_connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO question_embeddings (cache_key, vector, created_at) VALUES (?, ?, ?)",
+            (cache_key, np.asarray(vector, dtype=np.float32).tobytes(), created_at)
+        )
+        connection.commit()
+
+def put_memory_entry(cache_key, vector, created_at):
+    with _memory_lock:
+        _memory_cache[cache_key] = (vector, created_at)
+        _memory_cache.move_to_end(cache_key)
+        while len(_memory_cache) > EMBEDDING_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+        set_gauge("embedding_cache.size", len(_memory_cache))
+
+async def get_cached_embedding(question):
+    """Return the cached vector for a question, or None. Checks memory first, then the optional disk store."""
+    if EMBEDDING_CACHE_SIZE <= 0:
+        return None
+    cache_key = get_cache_key(question)
+
+    with _memory_lock:
+        entry = _memory_cache.get(cache_key)
+        if entry and time.time() - entry[1] <= EMBEDDING_CACHE_TTL:
+            _memory_cache.move_to_end(cache_key)
+            increment("embedding_cache.hit")
+            return entry[0]
+        if entry:
+            del _memory_cache[cache_key]
+
+    if EMBEDDING_CACHE_PATH:
+        try:
+            entry = await asyncio.to_thread(read_disk_entry, cache_key)
+        except sqlite3.Error as e:
+            logger.warning(f"Error reading embedding cache: {e}")
+            entry = None
+        if entry:
+            put_memory_entry(cache_key, *entry)
+            increment("embedding_cache.disk_hit")
+            return entry[0]
+
+    increment("embedding_cache.miss")
+    return None
+
+async def store_embedding(question, vector):
+    if EMBEDDING_CACHE_SIZE <= 0:
+        return
+    cache_key = get_cache_key(question)
+    vector = np.asarray(vector, dtype=np.float32)
+    # Cached vectors are shared between requests, so they are made read-only
+    vector.setflags(write=False)
+    created_at = time.time()
+    put_memory_entry(cache_key, vector, created_at)
+
+    if EMBEDDING_CACHE_PATH:
+        try:
+            await asyncio.to_thread(write_disk_entry, cache_key, vector, created_at)
+        except sqlite3.Error as e:
+            logger.warning(f"Error writing embedding cache: {e}")
+
+def close_embedding_cache():
+    global _disk_connection
+    with _disk_lock:
+        if _disk_connection is not None:
+            _disk_connection.close()
+            _disk_connection = None
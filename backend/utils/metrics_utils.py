@@ -0,0 +1,46 @@
+# backend/utils/metrics_utils.py
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+def observe(name, value_ms):
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0})
+        timing["count"] += 1
+        timing["total_ms"] += value_ms
+        timing["max_ms"] = max(timing["max_ms"], value_ms)
+        timing["last_ms"] = value_ms
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - start) * 1000)
+
+def get_metrics_snapshot():
+    with _lock:
+        timings = {
+            name: {**timing, "avg_ms": timing["total_ms"] / timing["count"] if timing["count"] else 0.0}
+            for name, timing in _timings.items()
+        }
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": timings
+        }
@@ -1,52 +1,151 @@
 # backend/utils/pdf_utils.py
 import os
-from fastapi import HTTPException
-from fastapi.responses import StreamingResponse, FileResponse
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, FileResponse
 from io import BytesIO
 from pypdf import PdfReader, PdfWriter
 import logging
 from urllib.parse import quote
-from config import PDF_MANUAL_DIR, PDF_FAQ_DIR
+from .metrics_utils import increment, observe, set_gauge
+from config import (
+    PDF_MANUAL_DIR, PDF_FAQ_DIR, PDF_PAGE_CACHE_DIR, PDF_PAGE_CACHE_MEMORY_BYTES, PDF_RENDER_WORKERS
+)
 
 logger = logging.getLogger(__name__)
 
+# Browsers may keep PDFs but revalidate them; unchanged sources answer 304 from the ETag
+CACHE_CONTROL = "no-cache"
+
+_executor = ThreadPoolExecutor(max_workers=PDF_RENDER_WORKERS, thread_name_prefix="pdf")
+_memory_cache = OrderedDict()
+_memory_bytes = 0
+_memory_lock = threading.Lock()
+_checksums = {}
+_checksum_lock = threading.Lock()
+_rendering = {}
+
+def get_source_checksum(file_path, stat_result):
+    """sha256 of the source PDF, recomputed when the file changes; batch/src/prewarm_pdf_cache.py keys entries the same way."""
+    with _checksum_lock:
+        entry = _checksums.get(file_path)
+        if entry and entry[:2] == (stat_result.st_mtime_ns, stat_result.st_size):
+            return entry[2]
+    with open(file_path, 'rb') as f:
+        checksum = hashlib.sha256(f.read()).hexdigest()
+    with _checksum_lock:
+        _checksums[file_path] = (stat_result.st_mtime_ns, stat_result.st_size, checksum)
+    return checksum
+
+def get_disk_cache_path(checksum, start_page, end_page):
+    # Content-addressed: a changed source gets a new directory, and old entries are never served
+    return os.path.join(PDF_PAGE_CACHE_DIR, checksum[:2], checksum, f"{start_page}-{end_page}.pdf")
+
 def create_pdf_range(file_path: str, start_page: int, end_page: int):
-    try:
-        pdf_reader = PdfReader(file_path)
-        pdf_writer = PdfWriter()
+    pdf_reader = PdfReader(file_path)
+    pdf_writer = PdfWriter()
 
-        for page_num in range(start_page - 1, min(end_page, len(pdf_reader.pages))):
-            pdf_writer.add_page(pdf_reader.pages[page_num])
+    if not 1 <= start_page <= len(pdf_reader.pages):
+        raise ValueError(f"Invalid page number: {start_page}")
+    for page_num in range(start_page - 1, min(end_page, len(pdf_reader.pages))):
+        pdf_writer.add_page(pdf_reader.pages[page_num])
 
-        pdf_bytes = BytesIO()
-        pdf_writer.write(pdf_bytes)
-        pdf_bytes.seek(0)
+    pdf_bytes = BytesIO()
+    pdf_writer.write(pdf_bytes)
+    return pdf_bytes.getvalue()
 
+def get_memory_entry(key):
+    with _memory_lock:
+        pdf_bytes = _memory_cache.get(key)
+        if pdf_bytes is not None:
+            _memory_cache.move_to_end(key)
         return pdf_bytes
-    except Exception as e:
-        logger.error(f"Error creating PDF range: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error creating PDF range: {str(e)}")
 
-def create_single_page_pdf(file_path: str, page: int):
-    try:
-        pdf_reader = PdfReader(file_path)
-        pdf_writer = PdfWriter()
+def put_memory_entry(key, pdf_bytes):
+    global _memory_bytes
+    if len(pdf_bytes) > PDF_PAGE_CACHE_MEMORY_BYTES:
+        return
+    with _memory_lock:
+        if key in _memory_cache:
+            return
+        _memory_cache[key] = pdf_bytes
+        _memory_bytes += len(pdf_bytes)
+        while _memory_bytes > PDF_PAGE_CACHE_MEMORY_BYTES:
+            _, evicted = _memory_cache.popitem(last=False)
+            _memory_bytes -= len(evicted)
+        set_gauge("pdf_cache.memory_bytes", _memory_bytes)
 
-        if 1 <= page <= len(pdf_reader.pages):
-            pdf_writer.add_page(pdf_reader.pages[page - 1])
-        else:
-            raise ValueError(f"Invalid page number: {page}")
+def load_pdf_range(file_path, checksum, start_page, end_page):
+    """Runs in the PDF worker pool: read the range from the disk cache, or extract it and store it there."""
+    cache_path = get_disk_cache_path(checksum, start_page, end_page) if PDF_PAGE_CACHE_DIR else None
+    if cache_path:
+        try:
+            with open(cache_path, 'rb') as f:
+                increment("pdf_cache.disk_hit")
+                return f.read()
+        except FileNotFoundError:
+            pass
+
+    increment("pdf_cache.miss")
+    start = time.perf_counter()
+    pdf_bytes = create_pdf_range(file_path, start_page, end_page)
+    observe("pdf_render_ms", (time.perf_counter() - start) * 1000)
 
-        pdf_bytes = BytesIO()
-        pdf_writer.write(pdf_bytes)
-        pdf_bytes.seek(0)
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Error writing PDF page cache {cache_path}: {e}")
+    return pdf_bytes
 
+async def get_pdf_range(file_path, checksum, start_page, end_page):
+    key = (checksum, start_page, end_page)
+    pdf_bytes = get_memory_entry(key)
+    if pdf_bytes is not None:
+        increment("pdf_cache.hit")
         return pdf_bytes
-    except Exception as e:
-        logger.error(f"Error creating single page PDF: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error creating single page PDF: {str(e)}")
 
-def get_pdf(document_type: str, category: str, path: str, page: int = None, start_page: int = None, end_page: int = None):
+    # Concurrent requests for the same range share one extraction
+    task = _rendering.get(key)
+    if task is None:
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(loop.run_in_executor(_executor, load_pdf_range, file_path, checksum, start_page, end_page))
+        _rendering[key] = task
+        task.add_done_callback(lambda _: _rendering.pop(key, None))
+    pdf_bytes = await asyncio.shield(task)
+    put_memory_entry(key, pdf_bytes)
+    return pdf_bytes
+
+def is_not_modified(request: Request, etag, last_modified_time):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(last_modified_time) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def not_modified_response(headers):
+    increment("pdf_not_modified")
+    return Response(status_code=304, headers={
+        name: value for name, value in headers.items() if name.lower() in ("etag", "last-modified", "cache-control")
+    })
+
+async def get_pdf(request: Request, document_type: str, category: str, path: str, page: int = None, start_page: int = None, end_page: int = None):
     if document_type == "manual":
         file_path = os.path.join(PDF_MANUAL_DIR, category, path)
     elif document_type == "faq":
@@ -61,27 +160,41 @@ def get_pdf(document_type: str, category: str, path: str, page: int = None, star
         raise HTTPException(status_code=404, detail=f"PDF file not found: {file_path}")
 
     try:
-        if page is not None:
-            logger.info(f"Extracting page {page} from PDF file: {file_path}")
-            pdf_bytes = create_single_page_pdf(file_path, page)
-            headers = {
-                "Content-Disposition": f'inline; filename*=UTF-8\'\'{quote(os.path.basename(path))}_page_{page}.pdf'
-            }
-            return StreamingResponse(pdf_bytes, media_type="application/pdf", headers=headers)
-        elif start_page is not None and end_page is not None:
+        stat_result = os.stat(file_path)
+        if page is not None or (start_page is not None and end_page is not None):
+            if page is not None:
+                start_page, end_page = page, page
+                file_name = f"{quote(os.path.basename(path))}_page_{page}.pdf"
+            else:
+                file_name = f"{quote(os.path.basename(path))}_pages_{start_page}-{end_page}.pdf"
             logger.info(f"Extracting pages {start_page} to {end_page} from PDF file: {file_path}")
-            pdf_bytes = create_pdf_range(file_path, start_page, end_page)
+
+            checksum = await asyncio.get_running_loop().run_in_executor(_executor, get_source_checksum, file_path, stat_result)
             headers = {
-                "Content-Disposition": f'inline; filename*=UTF-8\'\'{quote(os.path.basename(path))}_pages_{start_page}-{end_page}.pdf'
+                "Content-Disposition": f'inline; filename*=UTF-8\'\'{file_name}',
+                "ETag": f'"{checksum[:32]}-{start_page}-{end_page}"',
+                "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+                "Cache-Control": CACHE_CONTROL
             }
-            return StreamingResponse(pdf_bytes, media_type="application/pdf", headers=headers)
+            if is_not_modified(request, headers["ETag"], stat_result.st_mtime):
+                return not_modified_response(headers)
+
+            pdf_bytes = await get_pdf_range(file_path, checksum, start_page, end_page)
+            return Response(pdf_bytes, media_type="application/pdf", headers=headers)
         else:
             logger.info(f"Serving full PDF file: {file_path}")
             headers = {
-                "Content-Disposition": f'inline; filename*=UTF-8\'\'{quote(os.path.basename(path))}'
+                "Content-Disposition": f'inline; filename*=UTF-8\'\'{quote(os.path.basename(path))}',
+                "Cache-Control": CACHE_CONTROL
             }
-            return FileResponse(file_path, media_type="application/pdf", headers=headers)
+            # FileResponse sets ETag/Last-Modified from the file's stat and answers Range requests itself
+            response = FileResponse(file_path, media_type="application/pdf", headers=headers, stat_result=stat_result)
+            if is_not_modified(request, response.headers["etag"], stat_result.st_mtime):
+                return not_modified_response(response.headers)
+            return response
     except Exception as e:
         logger.error(f"Error serving PDF file: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error serving PDF file: {str(e)}")
-    
\ No newline at end of file
+
+def close_pdf_executor():
+    _executor.shutdown(wait=False, cancel_futures=True)
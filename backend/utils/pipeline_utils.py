@@ -0,0 +1,60 @@
+# backend/utils/pipeline_utils.py
+import asyncio
+import logging
+from .metrics_utils import timer
+
+logger = logging.getLogger(__name__)
+
+class StageExecutor:
+    """Runs pipeline stages as concurrent tasks; stages await each other's results by name."""
+
+    def __init__(self):
+        self._tasks = {}
+
+    def start(self, name, coro):
+        if name in self._tasks:
+            raise ValueError(f"Stage already started: {name}")
+        self._tasks[name] = asyncio.create_task(self._run(name, coro), name=name)
+        return self._tasks[name]
+
+    async def _run(self, name, coro):
+        with timer(f"stage_{name}_ms"):
+            return await coro
+
+    async def result(self, name):
+        return await self._tasks[name]
+
+    def cancel(self, name):
+        self._tasks[name].cancel()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # Stages still running when the pipeline exits (error or cancel) are abandoned
+        pending = [task for task in self._tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.debug(f"Cancelled pending stages: {[task.get_name() for task in pending]}")
+        return False
+
+class DeferredSender:
+    """Holds a stage's messages back until release(), then passes them (and later ones) to the websocket in order."""
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+        self._pending = []
+        self._live = False
+
+    async def send_json(self, data):
+        if self._live:
+            await self._websocket.send_json(data)
+        else:
+            self._pending.append(data)
+
+    async def release(self):
+        while self._pending:
+            await self._websocket.send_json(self._pending.pop(0))
+        self._live = True
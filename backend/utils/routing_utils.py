@@ -0,0 +1,70 @@
+# backend/utils/routing_utils.py
+import asyncio
+import logging
+import numpy as np
+from .db_utils import get_document_cache, load_toc_entries
+from .search_backends import score_matrix, to_numpy_vector
+from .metrics_utils import increment
+from config import *
+
+logger = logging.getLogger(__name__)
+
+_toc_indexes = {}
+_toc_index_lock = asyncio.Lock()
+
+async def get_toc_index(category):
+    """TOC entries and their embedding matrix for a category, rebuilt when document_table changes."""
+    cache = await get_document_cache()
+    index = _toc_indexes.get(category)
+    if index and index["version"] == cache["version"]:
+        return index
+
+    async with _toc_index_lock:
+        index = _toc_indexes.get(category)
+        if index and index["version"] == cache["version"]:
+            return index
+
+        rows = await load_toc_entries(category)
+        index = {
+            "version": cache["version"],
+            "entries": [
+                {"file_name": file_name, "start_page": start_page, "end_page": end_page, "chapter": chapter, "section": section}
+                for file_name, start_page, end_page, chapter, section, _ in rows
+            ],
+            "matrix": np.array([to_numpy_vector(row[-1]) for row in rows], dtype=np.float32).reshape(len(rows), -1)
+        }
+        _toc_indexes[category] = index
+        logger.info(f"Loaded {len(rows)} TOC entries for category {category}")
+        return index
+
+def overlaps(entry, selected):
+    return (
+        entry["file_name"] == selected["file_name"]
+        and entry["start_page"] <= selected["end_page"]
+        and selected["start_page"] <= entry["end_page"]
+    )
+
+async def route_by_vector(question_vector, category, top_n=TOC_ROUTING_TOP_N):
+    """Pick the top page ranges by similarity between the question and the TOC entries.
+
+    Entries overlapping an already selected range of the same PDF are skipped, matching
+    the LLM prompt's rule that the two answers must not repeat the same content.
+    Returns an empty list when the category has no TOC entries.
+    """
+    index = await get_toc_index(int(category))
+    if not index["entries"]:
+        return []
+
+    distances = score_matrix(index["matrix"], question_vector)
+    selected = []
+    for i in np.argsort(distances):
+        entry = index["entries"][i]
+        if any(overlaps(entry, chosen) for chosen in selected):
+            continue
+        selected.append(entry)
+        if len(selected) >= top_n:
+            break
+
+    increment("toc_routing.vector")
+    logger.debug(f"Vector TOC routing for category {category}: {[(e['file_name'], e['start_page'], e['end_page']) for e in selected]}")
+    return selected
@@ -0,0 +1,250 @@
+# backend/utils/search_backends.py
+import asyncio
+import logging
+import time
+import numpy as np
+from .db_utils import execute_pgvector_search, get_document_cache, load_document_chunks
+from .metrics_utils import observe, increment
+from .snapshot_utils import get_snapshot, get_category_slice, get_snapshot_row
+from config import *
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_TYPES = {
+    PDF_MANUAL_TABLE: DOCUMENT_TYPE_PDF_MANUAL,
+    PDF_FAQ_TABLE: DOCUMENT_TYPE_PDF_FAQ
+}
+
+# Position of document_page in each table's SEARCH_COLUMNS
+SEARCH_PAGE_COLUMN = {
+    PDF_MANUAL_TABLE: 2,
+    PDF_FAQ_TABLE: 1
+}
+
+# Rows converted to float32 at a time when scoring a float16 matrix
+SCORE_BLOCK_ROWS = 4096
+
+class SearchBackend:
+    """Interface behind execute_search_query.
+
+    search() returns rows shaped like the pgvector search query:
+    the table's SEARCH_COLUMNS, then distance, file_path, file_name and the chunk embedding.
+    """
+
+    name = "base"
+
+    async def search(self, question_vector, category, top_n, table_name, excluded_pages=None):
+        raise NotImplementedError
+
+class PostgresSearchBackend(SearchBackend):
+    name = "postgres"
+
+    async def search(self, question_vector, category, top_n, table_name, excluded_pages=None):
+        return await execute_pgvector_search(question_vector, category, top_n, table_name, excluded_pages)
+
+def to_numpy_vector(embedding):
+    # pgvector returns numpy arrays for vector columns and HalfVector objects for halfvec columns
+    if hasattr(embedding, "to_numpy"):
+        embedding = embedding.to_numpy()
+    return np.asarray(embedding, dtype=np.float32)
+
+def score_block(block, question_vector):
+    if OPERATOR == "<->":
+        difference = block - question_vector
+        return np.sqrt(np.einsum("ij,ij->i", difference, difference))
+
+    inner_products = block @ question_vector
+    if OPERATOR == "<#>":
+        return -inner_products
+    if OPERATOR == "<=>":
+        norms = np.linalg.norm(block, axis=1) * np.linalg.norm(question_vector)
+        return 1 - inner_products / np.where(norms > 0, norms, 1)
+    raise ValueError(f"Unsupported operator for numpy search: {OPERATOR}")
+
+def score_matrix(matrix, question_vector):
+    """Distances with the same meaning and ordering as the pgvector OPERATOR."""
+    question_vector = np.asarray(question_vector, dtype=np.float32)
+    if matrix.dtype == np.float32:
+        return score_block(matrix, question_vector)
+    # float16 has no BLAS path; upcast in bounded blocks instead of copying the whole matrix
+    return np.concatenate([
+        score_block(matrix[start:start + SCORE_BLOCK_ROWS].astype(np.float32), question_vector)
+        for start in range(0, len(matrix), SCORE_BLOCK_ROWS)
+    ])
+
+class NumpySearchBackend(SearchBackend):
+    """Scores a category's chunks with one matrix-vector product held in process memory.
+
+    When the batch snapshot matches document_table, the matrix is a memory-mapped view of it
+    shared by all workers. Otherwise chunks are cached per document and checksum, so a change
+    in document_table only reloads the documents whose checksum changed.
+    """
+
+    name = "numpy"
+
+    def __init__(self, dtype=NUMPY_SEARCH_DTYPE):
+        self.dtype = np.dtype(dtype)
+        self._documents = {}
+        self._indexes = {}
+        self._locks = {}
+
+    def _get_category_documents(self, cache, table_name, category):
+        document_type = DOCUMENT_TYPES[table_name]
+        return {
+            document_table_id: document
+            for document_table_id, document in cache["documents"].items()
+            if document["document_type"] == document_type and category in document["categories"]
+        }
+
+    async def _load_documents(self, table_name, documents):
+        stale_ids = [
+            document_table_id for document_table_id, document in documents.items()
+            if self._documents.get((table_name, document_table_id), {}).get("checksum") != document["checksum"]
+        ]
+        if not stale_ids:
+            return
+
+        rows_by_document = {document_table_id: [] for document_table_id in stale_ids}
+        for row in await load_document_chunks(table_name, stale_ids):
+            rows_by_document[row[0]].append(row)
+
+        for document_table_id, rows in rows_by_document.items():
+            self._documents[(table_name, document_table_id)] = {
+                "checksum": documents[document_table_id]["checksum"],
+                "rows": [row[:-1] for row in rows],
+                "pages": np.array([row[SEARCH_PAGE_COLUMN[table_name]] for row in rows], dtype=np.int32),
+                "embeddings": np.array([to_numpy_vector(row[-1]) for row in rows], dtype=self.dtype).reshape(len(rows), -1)
+            }
+        increment(f"numpy_search_documents_loaded.{table_name}", len(stale_ids))
+        logger.info(f"Loaded {len(stale_ids)} documents into the numpy search backend for {table_name}")
+
+    async def _get_index(self, table_name, category):
+        cache = await get_document_cache()
+        snapshot = get_snapshot()
+        if snapshot and snapshot["document_version"] != cache["version"]:
+            # The snapshot lags (or leads) document_table; score the tables' own rows until they agree
+            snapshot = None
+        snapshot_version = snapshot["version"] if snapshot else None
+
+        key = (table_name, category)
+        index = self._indexes.get(key)
+        if index and index["version"] == cache["version"] and index["snapshot_version"] == snapshot_version:
+            return index
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(key)
+            if index and index["version"] == cache["version"] and index["snapshot_version"] == snapshot_version:
+                return index
+
+            start = time.perf_counter()
+            if snapshot:
+                index = self._build_snapshot_index(cache["version"], snapshot, table_name, category)
+                # Rows loaded from the tables are no longer needed once the snapshot is current
+                for document_key in [k for k in self._documents if k[0] == table_name]:
+                    del self._documents[document_key]
+            else:
+                documents = self._get_category_documents(cache, table_name, category)
+                await self._load_documents(table_name, documents)
+                index = self._build_index(cache["version"], table_name, documents)
+
+                # Drop cached documents that no longer exist
+                for document_key in [k for k in self._documents if k[0] == table_name and k[1] not in cache["documents"]]:
+                    del self._documents[document_key]
+            self._indexes[key] = index
+
+            observe("numpy_search_index_build_ms", (time.perf_counter() - start) * 1000)
+            source = f"snapshot {snapshot_version}" if snapshot else "tables"
+            logger.info(f"Built numpy search index for {table_name}, category {category} from {source}: {index['size']} chunks")
+            return index
+
+    def _build_index(self, version, table_name, documents):
+        rows, embeddings, pages, document_indexes, index_documents = [], [], [], [], []
+        for document_table_id in sorted(documents, key=str):
+            loaded = self._documents[(table_name, document_table_id)]
+            if not loaded["rows"]:
+                continue
+            rows.extend(loaded["rows"])
+            embeddings.append(loaded["embeddings"])
+            pages.append(loaded["pages"])
+            document_indexes.append(np.full(len(loaded["rows"]), len(index_documents), dtype=np.int32))
+            index_documents.append({"id": document_table_id, **documents[document_table_id]})
+
+        return {
+            "version": version,
+            "snapshot_version": None,
+            "size": len(rows),
+            "row": rows.__getitem__,
+            "matrix": np.ascontiguousarray(np.concatenate(embeddings)) if embeddings else np.empty((0, 0), dtype=self.dtype),
+            "pages": np.concatenate(pages) if pages else np.empty(0, dtype=np.int32),
+            "document_indexes": np.concatenate(document_indexes) if document_indexes else np.empty(0, dtype=np.int32),
+            "documents": index_documents
+        }
+
+    def _build_snapshot_index(self, version, snapshot, table_name, category):
+        table = snapshot["tables"].get(table_name)
+        start, end = get_category_slice(table, category) if table else (0, 0)
+        # Slices of the memory-mapped arrays are views; nothing is copied into this worker
+        return {
+            "version": version,
+            "snapshot_version": snapshot["version"],
+            "size": end - start,
+            "row": lambda i: get_snapshot_row(snapshot, table_name, start + i),
+            "matrix": table["embeddings"][start:end] if table else np.empty((0, 0), dtype=np.float16),
+            "pages": table["pages"][start:end] if table else np.empty(0, dtype=np.int32),
+            "document_indexes": table["document_indexes"][start:end] if table else np.empty(0, dtype=np.int32),
+            "documents": snapshot["documents"]
+        }
+
+    async def search(self, question_vector, category, top_n, table_name, excluded_pages=None):
+        index = await self._get_index(table_name, int(category))
+        if index["size"] == 0:
+            return []
+
+        start = time.perf_counter()
+        distances = score_matrix(index["matrix"], question_vector)
+        for excluded in excluded_pages or []:
+            excluded_documents = [i for i, document in enumerate(index["documents"]) if document["file_name"] == excluded['file_name']]
+            if not excluded_documents:
+                continue
+            excluded_mask = (
+                np.isin(index["document_indexes"], excluded_documents)
+                & (index["pages"] >= excluded['start_page'])
+                & (index["pages"] <= excluded['end_page'])
+            )
+            distances[excluded_mask] = np.inf
+
+        candidate_count = min(top_n, int(np.isfinite(distances).sum()))
+        if candidate_count == 0:
+            return []
+        top_indices = np.argpartition(distances, candidate_count - 1)[:candidate_count]
+        top_indices = top_indices[np.argsort(distances[top_indices])]
+        observe(f"search_query_ms.{table_name}.numpy", (time.perf_counter() - start) * 1000)
+
+        results = []
+        for i in top_indices:
+            document = index["documents"][index["document_indexes"][i]]
+            results.append((
+                *index["row"](i), float(distances[i]), document["file_path"], document["file_name"],
+                np.asarray(index["matrix"][i], dtype=np.float32)
+            ))
+        return results
+
+postgres_backend = PostgresSearchBackend()
+numpy_backend = NumpySearchBackend()
+
+async def get_search_backend(category, table_name):
+    if SEARCH_BACKEND == "postgres":
+        return postgres_backend
+    if SEARCH_BACKEND == "numpy":
+        return numpy_backend
+    if SEARCH_BACKEND == "auto":
+        cache = await get_document_cache()
+        chunk_count = cache["chunk_counts"].get((table_name, int(category)), 0)
+        return numpy_backend if chunk_count <= NUMPY_SEARCH_MAX_ROWS else postgres_backend
+    raise ValueError(f"Unsupported SEARCH_BACKEND: {SEARCH_BACKEND}")
+
+async def execute_search_query(question_vector, category, top_n, table_name, excluded_pages=None):
+    backend = await get_search_backend(category, table_name)
+    increment(f"search_backend.{backend.name}")
+    return await backend.search(question_vector, category, top_n, table_name, excluded_pages)
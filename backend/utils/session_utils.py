@@ -0,0 +1,85 @@
+# backend/utils/session_utils.py
+import asyncio
+import json
+import logging
+import uuid
+from .metrics_utils import increment, set_gauge
+
+logger = logging.getLogger(__name__)
+
+_active_requests = 0
+
+class RequestChannel:
+    """The websocket as seen by one request: every message is tagged with its request_id."""
+
+    def __init__(self, session, request_id):
+        self._session = session
+        self.request_id = request_id
+
+    async def send_json(self, data):
+        # request_id leads the frame, so the frontend proxy can route it without decoding the JSON
+        await self._session.send_json({"request_id": self.request_id, **data})
+
+class WebSocketSession:
+    """Questions asked on one websocket, each running as its own task.
+
+    Sends from concurrent requests go through one lock so frames are never interleaved.
+    Cancelling a request cancels its task, and with it any LLM stream, query or embedding call in flight.
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self._send_lock = asyncio.Lock()
+        self._tasks = {}
+
+    async def send_json(self, data):
+        text = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+        async with self._send_lock:
+            await self.websocket.send_text(text)
+
+    def start(self, request_id, handler):
+        """Run handler(channel) as a task; returns the request_id (generated when the client sent none)."""
+        global _active_requests
+        request_id = str(request_id) if request_id else uuid.uuid4().hex
+        if request_id in self._tasks:
+            self.cancel(request_id)
+        task = asyncio.create_task(self._run(handler, RequestChannel(self, request_id)))
+        self._tasks[request_id] = task
+        _active_requests += 1
+        set_gauge("websocket_requests_active", _active_requests)
+        task.add_done_callback(lambda task: self._finished(request_id, task))
+        return request_id
+
+    async def _run(self, handler, channel):
+        # Every request ends with request_end, or cancelled when the client stopped it, so the frontend proxy can forget its id
+        try:
+            await handler(channel)
+        finally:
+            if not asyncio.current_task().cancelling():
+                await channel.send_json({"request_end": True})
+
+    def _finished(self, request_id, task):
+        global _active_requests
+        if self._tasks.get(request_id) is task:
+            del self._tasks[request_id]
+        _active_requests -= 1
+        set_gauge("websocket_requests_active", _active_requests)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Request {request_id} failed: {task.exception()}")
+
+    def cancel(self, request_id):
+        task = self._tasks.pop(request_id, None)
+        if task is None:
+            return False
+        task.cancel()
+        increment("websocket_requests_cancelled")
+        logger.info(f"Cancelled request {request_id}")
+        return True
+
+    async def close(self):
+        # The client is gone: nothing still running for it is worth finishing
+        tasks = list(self._tasks.values())
+        for request_id in list(self._tasks):
+            self.cancel(request_id)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
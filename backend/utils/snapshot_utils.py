@@ -0,0 +1,99 @@
+# backend/utils/snapshot_utils.py
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import numpy as np
+from .metrics_utils import increment, observe
+from config import *
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+SNAPSHOT_ARRAYS = ["embeddings", "categories", "document_indexes", "pages", "numbers", "text_offsets"]
+
+_snapshot = {"version": None, "checked_at": 0.0, "data": None}
+_snapshot_lock = threading.Lock()
+
+def read_current_version():
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def load_snapshot(version):
+    """Memory-map a snapshot written by batch/src/export_snapshot.py.
+
+    Arrays are opened read-only with mmap, so every worker shares the same page-cache copy
+    and loading only reads the manifest and the .npy headers.
+    """
+    snapshot_path = os.path.join(SNAPSHOT_DIR, version)
+    with open(os.path.join(snapshot_path, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    documents = [
+        {**document, "id": uuid.UUID(document["id"])}
+        for document in manifest["documents"]
+    ]
+    tables = {}
+    for table_name, table_info in manifest["tables"].items():
+        if table_info["rows"] == 0:
+            continue
+        prefix = os.path.join(snapshot_path, table_name)
+        table = {name: np.load(f"{prefix}.{name}.npy", mmap_mode="r") for name in SNAPSHOT_ARRAYS}
+        table["text"] = np.memmap(f"{prefix}.text.bin", dtype=np.uint8, mode="r") if table["text_offsets"][-1] > 0 else np.empty(0, dtype=np.uint8)
+        tables[table_name] = table
+
+    return {
+        "version": version,
+        "document_version": manifest["document_version"],
+        "documents": documents,
+        "tables": tables
+    }
+
+def get_snapshot():
+    """Return the current memory-mapped snapshot, switching to a new version when CURRENT changes."""
+    if time.monotonic() - _snapshot["checked_at"] < DOCUMENT_CACHE_CHECK_INTERVAL:
+        return _snapshot["data"]
+
+    with _snapshot_lock:
+        if time.monotonic() - _snapshot["checked_at"] < DOCUMENT_CACHE_CHECK_INTERVAL:
+            return _snapshot["data"]
+
+        version = read_current_version()
+        if version != _snapshot["version"]:
+            start = time.perf_counter()
+            try:
+                data = load_snapshot(version) if version else None
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Failed to load snapshot {version}: {e}")
+                data = None
+            else:
+                observe("snapshot_load_ms", (time.perf_counter() - start) * 1000)
+                increment("snapshot_reloads")
+                if data:
+                    logger.info(f"Mapped snapshot {version} (document version {data['document_version']})")
+            # Older arrays stay mapped until the indexes built on them are replaced
+            _snapshot.update(version=version, data=data)
+        _snapshot["checked_at"] = time.monotonic()
+    return _snapshot["data"]
+
+def get_category_slice(table, category):
+    """Rows are ordered by category, so one category is a contiguous [start, end) range."""
+    categories = table["categories"]
+    return int(np.searchsorted(categories, category, side="left")), int(np.searchsorted(categories, category, side="right"))
+
+def get_snapshot_row(snapshot, table_name, position):
+    """Rebuild one row in the table's SEARCH_COLUMNS order."""
+    table = snapshot["tables"][table_name]
+    document_table_id = snapshot["documents"][table["document_indexes"][position]]["id"]
+    text = bytes(table["text"][table["text_offsets"][position]:table["text_offsets"][position + 1]]).decode("utf-8")
+    page = int(table["pages"][position])
+    number = int(table["numbers"][position])
+    if table_name == PDF_FAQ_TABLE:
+        return (document_table_id, page, number, text)
+    return (document_table_id, number, page, text)
@@ -0,0 +1,53 @@
+# backend/utils/streaming_utils.py
+import asyncio
+import logging
+from .metrics_utils import increment
+from config import STREAM_FLUSH_INTERVAL_MS, STREAM_FLUSH_BYTES
+
+logger = logging.getLogger(__name__)
+
+class TokenBatcher:
+    """Coalesces streamed LLM deltas into fewer {key: text} frames.
+
+    Pending text is sent once it reaches STREAM_FLUSH_BYTES or has waited STREAM_FLUSH_INTERVAL_MS,
+    whichever comes first; close() sends whatever is left. An interval of 0 sends every delta as it comes.
+    """
+
+    def __init__(self, websocket, key):
+        self._websocket = websocket
+        self._key = key
+        self._parts = []
+        self._size = 0
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    async def add(self, text):
+        self._parts.append(text)
+        self._size += len(text.encode("utf-8"))
+        increment("stream_deltas")
+        if self._size >= STREAM_FLUSH_BYTES or STREAM_FLUSH_INTERVAL_MS <= 0:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(STREAM_FLUSH_INTERVAL_MS / 1000)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # The lock keeps frames in order when a timed flush and a size flush overlap
+        async with self._lock:
+            if not self._parts:
+                return
+            text = "".join(self._parts)
+            self._parts = []
+            self._size = 0
+            increment("stream_frames")
+            await self._websocket.send_json({self._key: text})
+
+    async def close(self):
+        await self.flush()
@@ -1,83 +1,207 @@
 # backend/utils/websocket_utils.py
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
+import asyncio
 import logging
+import numpy as np
 from fastapi import WebSocket
 from .db_utils import (
-    get_category_name, format_result, is_excluded, execute_search_query,
-    get_toc_data, get_chunk_text_for_pages, get_document_id
+    get_category_name, format_result, get_toc_data, get_chunks_for_pages, get_document_id, get_document_cache
 )
+from .search_backends import execute_search_query, to_numpy_vector
+from .routing_utils import route_by_vector
+from .embedding_cache_utils import get_cached_embedding, store_embedding, normalize_question
+from .answer_cache_utils import AnswerRecorder, find_cached_answer, store_answer, replay_answer
+from .context_utils import build_toc_context, build_final_context, select_diverse, cosine_distance
+from .metrics_utils import increment
+from .admission_utils import ServerBusyError
+from .pipeline_utils import StageExecutor, DeferredSender
+from .streaming_utils import TokenBatcher
+from .coalescing_utils import run_coalesced
 from config import *
 
 logger = logging.getLogger(__name__)
 
 def get_openai_client():
-    return AzureOpenAI(
+    return AsyncAzureOpenAI(
         azure_endpoint=AZURE_OPENAI_ENDPOINT,
         api_key=AZURE_OPENAI_API_KEY,
         api_version=AZURE_OPENAI_API_VERSION
     )
 
-async def process_websocket_message_openai(websocket: WebSocket, conn, data, client):
-    try:
-        question = data["question"]
-        category = data.get("category")
+async def process_websocket_message_openai(websocket: WebSocket, data, client):
+    question = data.get("question")
+    category = data.get("category")
+    use_answer_cache = ANSWER_CACHE_SIZE > 0 and not data.get("no_cache")
+
+    if not question:
+        await websocket.send_json({"error": "Question is required"})
+        return
+
+    if not category:
+        await websocket.send_json({"error": "Category is required"})
+        return
 
-        if not category:
-            await websocket.send_json({"error": "Category is required"})
-            return
+    async def pipeline(flight):
+        try:
+            await run_question_pipeline(flight, question, category, client, use_answer_cache)
+        except ServerBusyError as e:
+            await flight.send_json({"error": str(e), "busy": True})
 
+    # Identical questions asked while one is being answered share its execution and streamed messages
+    key = (normalize_question(question), str(category), use_answer_cache)
+    await run_coalesced(key, websocket, pipeline)
+
+async def run_question_pipeline(websocket: WebSocket, question, category, client, use_answer_cache=False):
+    try:
         logger.debug(f"Processing question: {question[:50]}... in category: {category}")
 
-        # Generate first AI response
-        toc_data = get_toc_data(conn, category)
-        first_response = await generate_first_ai_response(client, question, toc_data, websocket, category, conn)
-
-        # Parse the first response to get PDF info
-        pdf_info = parse_first_response(first_response, category)
-        await websocket.send_json({"pdf_info": pdf_info})
-
-        # Process search results
-        question_vector = client.embeddings.create(
-            input=question,
-            model=AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT
-        ).data[0].embedding
-
-        excluded_pages = [
-            {
-                'file_name': pdf['file_name'],
-                'start_page': pdf['start_page'],
-                'end_page': pdf['end_page']
-            } for pdf in pdf_info
-        ]
-
-        manual_results, faq_results, manual_texts, faq_texts = await process_search_results(conn, question_vector, category, excluded_pages)
-
-        if not manual_results and not faq_results:
-            await websocket.send_json({"warning": "検索結果が見つかりませんでした。"})
-        else:
-            await websocket.send_json({"manual_results": manual_results})
-            await websocket.send_json({"faq_results": faq_results})
-
-        logger.debug(f"Sent search results for question: {question[:50]}... in category: {category}")
-
-        # Generate final AI response
-        chunk_texts = [
-            get_chunk_text_for_pages(conn, get_document_id(conn, pdf['file_name'], category), pdf['start_page'], pdf['end_page'])
-            for pdf in pdf_info
-        ]
-        if manual_texts or faq_texts or chunk_texts:
-            await generate_final_ai_response(client, question, chunk_texts, manual_texts, faq_texts, websocket)
-        else:
-            await websocket.send_json({"ai_response_chunk": "申し訳ありませんが、該当する情報が見つかりませんでした。"})
-            await websocket.send_json({"ai_response_end": True})
-            logger.info("No relevant information found for the query")
+        async with StageExecutor() as stages:
+            # The embedding starts right away: vector routing needs it, and LLM routing runs alongside it
+            stages.start("embedding", create_question_embedding(client, question))
+
+            if use_answer_cache:
+                # The version is taken before answering, so an answer built while documents change is not kept
+                document_version = (await get_document_cache())["version"]
+                entry, similarity = await find_cached_answer(await stages.result("embedding"), category, document_version)
+                if entry:
+                    await replay_answer(websocket, entry, similarity)
+                    return
+                websocket = AnswerRecorder(websocket)
+
+            # Routing runs alongside the FAQ match; its messages are held back until the FAQ fast path is ruled out
+            routing_websocket = DeferredSender(websocket)
+            stages.start("faq_match", find_faq_match(category, stages))
+            stages.start("routing", route_question(client, question, category, routing_websocket, stages))
+
+            faq_match = await stages.result("faq_match")
+            if faq_match:
+                stages.cancel("routing")
+                await answer_from_faq(client, question, *faq_match, websocket)
+            else:
+                await routing_websocket.release()
+                await answer_with_full_context(client, question, category, websocket, stages)
+
+            if use_answer_cache and not websocket.failed:
+                await store_answer(await stages.result("embedding"), category, websocket.messages, document_version)
 
+    except ServerBusyError:
+        raise
     except Exception as e:
         logger.error(f"Error processing message: {str(e)}")
-        if websocket.client_state == WebSocket.STATE_CONNECTED:
-            await websocket.send_json({"error": "An error occurred while processing your request"})
+        await websocket.send_json({"error": "An error occurred while processing your request"})
+
+async def answer_with_full_context(client, question, category, websocket: WebSocket, stages):
+    pdf_info = await stages.result("routing")
+    await websocket.send_json({"pdf_info": pdf_info})
+    page_chunks_task = stages.start("page_chunks", get_chunks_for_pdf_info(pdf_info, category))
+
+    excluded_pages = [
+        {
+            'file_name': pdf['file_name'],
+            'start_page': pdf['start_page'],
+            'end_page': pdf['end_page']
+        } for pdf in pdf_info
+    ]
+
+    question_vector = await stages.result("embedding")
+    manual_results, faq_results, manual_texts, faq_texts = await process_search_results(
+        question_vector, category, excluded_pages, page_chunks_task
+    )
+
+    if not manual_results and not faq_results:
+        await websocket.send_json({"warning": "検索結果が見つかりませんでした。"})
+    else:
+        await websocket.send_json({"manual_results": manual_results})
+        await websocket.send_json({"faq_results": faq_results})
 
-async def generate_first_ai_response(client, question, toc_data, websocket: WebSocket, category, conn):
+    logger.debug(f"Sent search results for question: {question[:50]}... in category: {category}")
+
+    # Generate final AI response from the budgeted context
+    chunk_texts, manual_texts, faq_texts, token_counts = build_final_context(
+        question_vector, await page_chunks_task, manual_texts, faq_texts
+    )
+    await websocket.send_json({"context_tokens": token_counts})
+    if manual_texts or faq_texts or any(chunk_texts):
+        await generate_final_ai_response(client, question, chunk_texts, manual_texts, faq_texts, websocket)
+    else:
+        await websocket.send_json({"ai_response_chunk": "申し訳ありませんが、該当する情報が見つかりませんでした。"})
+        await websocket.send_json({"ai_response_end": True})
+        logger.info("No relevant information found for the query")
+
+async def find_faq_match(category, stages):
+    """Return (faq_result, cosine distance) for the best FAQ hit when it is closer than FAQ_FAST_PATH_DISTANCE, else None."""
+    if FAQ_FAST_PATH_DISTANCE <= 0:
+        return None
+
+    question_vector = await stages.result("embedding")
+    rows = await execute_search_query(question_vector, category, 1, PDF_FAQ_TABLE)
+    if not rows:
+        return None
+    # The search score depends on OPERATOR (<#> is the negative inner product), so the distance is computed here
+    distance = cosine_distance(question_vector, to_numpy_vector(rows[0][-1]))
+    if distance >= FAQ_FAST_PATH_DISTANCE:
+        return None
+    return format_result(rows[0], category, "faq"), distance
+
+async def answer_from_faq(client, question, faq_result, distance, websocket: WebSocket):
+    increment("faq_fast_path")
+    logger.info(f"FAQ fast path: {faq_result['file_name']} No.{faq_result['faq_no']} (cosine distance {distance:.4f})")
+
+    await websocket.send_json({"faq_fast_path": {"distance": distance, "mode": FAQ_FAST_PATH_MODE}})
+    await websocket.send_json({"faq_results": [faq_result]})
+    if FAQ_FAST_PATH_MODE == "rephrase":
+        await generate_faq_answer(client, question, faq_result["chunk_text"], websocket)
+    else:
+        await websocket.send_json({"ai_response_chunk": faq_result["chunk_text"]})
+        await websocket.send_json({"ai_response_end": True})
+
+async def route_question(client, question, category, websocket: WebSocket, stages):
+    if TOC_ROUTING_MODE == "vector":
+        entries = await route_by_vector(await stages.result("embedding"), category)
+        if entries:
+            category_name = get_category_name(int(category))
+            pdf_info = [
+                make_pdf_info(entry['file_name'], entry['start_page'], entry['end_page'], category_name)
+                for entry in entries
+            ]
+            # Same text as the LLM answer format, so the first response panel keeps working
+            await websocket.send_json({"first_ai_response_chunk": format_routing_response(pdf_info)})
+            await websocket.send_json({"first_ai_response_end": True})
+            return pdf_info
+        logger.warning(f"No TOC entries for category {category}; falling back to LLM routing")
+
+    increment("toc_routing.llm")
+    toc_data, _ = build_toc_context(await get_toc_data(category))
+    first_response = await generate_first_ai_response(client, question, toc_data, websocket, category)
+    return parse_first_response(first_response, category)
+
+def format_routing_response(pdf_info):
+    return "\n\n".join(
+        f"PDFファイル名: {pdf['file_name']}\nPDF開始ページ: {pdf['start_page']}\nPDF終了ページ: {pdf['end_page']}"
+        for pdf in pdf_info
+    )
+
+async def create_question_embedding(client, question):
+    cached_vector = await get_cached_embedding(question)
+    if cached_vector is not None:
+        return cached_vector
+
+    embedding_response = await client.embeddings.create(
+        input=question,
+        model=AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT
+    )
+    question_vector = np.asarray(embedding_response.data[0].embedding, dtype=np.float32)
+    await store_embedding(question, question_vector)
+    return question_vector
+
+async def get_chunks_for_pdf_info(pdf_info, category):
+    page_ranges = [
+        (await get_document_id(pdf['file_name'], category), pdf['start_page'], pdf['end_page'])
+        for pdf in pdf_info
+    ]
+    return await get_chunks_for_pages(page_ranges)
+
+async def generate_first_ai_response(client, question, toc_data, websocket: WebSocket, category):
     prompt_1st = f"""
     ユーザーの質問に対して、最も関連が高いと考えられる"PDFファイル名", "PDF開始ページ", "PDF終了ページ"を以下の目次情報を参考に、上位2件分を解答例の通りに適切に改行して回答して下さい。
     ただし、上位2件の内容は必ず同じ内容を重複して解答しないようにして下さい。
@@ -98,7 +222,7 @@ async def generate_first_ai_response(client, question, toc_data, websocket: WebS
     PDF終了ページ: 7
     """
 
-    response = client.chat.completions.create(
+    response = await client.chat.completions.create(
         model=MODEL_GPT4o_DEPLOY_NAME,
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -108,20 +232,26 @@ async def generate_first_ai_response(client, question, toc_data, websocket: WebS
     )
 
     first_response = ""
+    # Deltas are sent in batches rather than one frame per token
+    batcher = TokenBatcher(websocket, "first_ai_response_chunk")
     try:
-        for chunk in response:
+        async for chunk in response:
             if chunk.choices and len(chunk.choices) > 0:
                 if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
                     content = chunk.choices[0].delta.content
                     if content:
                         first_response += content
-                        await websocket.send_json({"first_ai_response_chunk": content})
+                        await batcher.add(content)
             else:
                 logger.warning("Received an empty chunk from OpenAI API")
     except Exception as e:
         logger.error(f"Error processing AI response: {str(e)}")
+        await batcher.flush()
         await websocket.send_json({"error": "Error generating first AI response"})
     finally:
+        # Closing the stream stops generation when the request was cancelled mid-answer
+        await response.close()
+        await batcher.close()
         await websocket.send_json({"first_ai_response_end": True})
         logger.debug(f"Sent streaming first AI response for question: {question[:50]}...")
 
@@ -144,7 +274,7 @@ async def generate_final_ai_response(client, question, chunk_texts, manual_texts
     {' '.join(faq_texts)}
     """
 
-    response = client.chat.completions.create(
+    response = await client.chat.completions.create(
         model=MODEL_GPT4o_DEPLOY_NAME,
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -153,22 +283,66 @@ async def generate_final_ai_response(client, question, chunk_texts, manual_texts
         stream=True
     )
 
+    batcher = TokenBatcher(websocket, "ai_response_chunk")
     try:
-        for chunk in response:
+        async for chunk in response:
             if chunk.choices and len(chunk.choices) > 0:
                 if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
                     content = chunk.choices[0].delta.content
                     if content:
-                        await websocket.send_json({"ai_response_chunk": content})
+                        await batcher.add(content)
             else:
                 logger.warning("Received an empty chunk from OpenAI API")
     except Exception as e:
         logger.error(f"Error processing AI response: {str(e)}")
+        await batcher.flush()
         await websocket.send_json({"error": "Error generating AI response"})
     finally:
+        await response.close()
+        await batcher.close()
         await websocket.send_json({"ai_response_end": True})
         logger.debug(f"Sent streaming AI response for question: {question[:50]}...")
 
+async def generate_faq_answer(client, question, faq_text, websocket: WebSocket):
+    prompt_faq = f"""
+    ユーザーの質問に対して、以下のQ&Aの内容だけを元に、簡潔に回答して下さい。
+
+    ユーザーの質問：
+    {question}
+
+    参考文書(Q&A):
+    {faq_text}
+    """
+
+    response = await client.chat.completions.create(
+        model=FAQ_FAST_PATH_DEPLOY_NAME,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt_faq}
+        ],
+        stream=True
+    )
+
+    batcher = TokenBatcher(websocket, "ai_response_chunk")
+    try:
+        async for chunk in response:
+            if chunk.choices and len(chunk.choices) > 0:
+                if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        await batcher.add(content)
+            else:
+                logger.warning("Received an empty chunk from OpenAI API")
+    except Exception as e:
+        logger.error(f"Error processing AI response: {str(e)}")
+        await batcher.flush()
+        await websocket.send_json({"error": "Error generating AI response"})
+    finally:
+        await response.close()
+        await batcher.close()
+        await websocket.send_json({"ai_response_end": True})
+        logger.debug(f"Sent streaming FAQ answer for question: {question[:50]}...")
+
 def parse_first_response(first_response, category):
     pdf_info = []
     lines = first_response.strip().split('\n')
@@ -180,12 +354,7 @@ def parse_first_response(first_response, category):
         if line.startswith("PDFファイル名:"):
             if current_pdf:
                 pdf_info.append(current_pdf)
-            file_name = line.split(":")[1].strip()
-            current_pdf = {
-                "file_name": file_name,
-                "category": category_name,
-                "link_text": f"/manual/{category_name}/{file_name}"
-            }
+            current_pdf = {"file_name": line.split(":")[1].strip()}
         elif line.startswith("PDF開始ページ:"):
             current_pdf["start_page"] = int(line.split(":")[1].strip())
         elif line.startswith("PDF終了ページ:"):
@@ -194,35 +363,42 @@ def parse_first_response(first_response, category):
     if current_pdf:
         pdf_info.append(current_pdf)
 
-    for pdf in pdf_info:
-        pdf["link"] = f"pdf/manual/{pdf['category']}/{pdf['file_name']}?start_page={pdf['start_page']}&end_page={pdf['end_page']}"
-        pdf["link_text"] += f", p.{pdf['start_page']}-p.{pdf['end_page']}"
-
-    return pdf_info
-
-async def process_search_results(conn, question_vector, category, excluded_pages):
-    manual_results = execute_search_query(conn, question_vector, category, 50, PDF_MANUAL_TABLE)
-    faq_results = execute_search_query(conn, question_vector, category, 50, PDF_FAQ_TABLE)
-
-    formatted_manual_results = []
-    formatted_faq_results = []
-    manual_texts = []
-    faq_texts = []
-
-    for result in manual_results:
-        formatted_result = format_result(conn, result, category, "manual")
-        if not is_excluded(formatted_result, excluded_pages):
-            formatted_manual_results.append(formatted_result)
-            manual_texts.append(formatted_result['chunk_text'])
-            if len(formatted_manual_results) == 4:
-                break
-
-    for result in faq_results:
-        formatted_result = format_result(conn, result, category, "faq")
-        if not is_excluded(formatted_result, excluded_pages):
-            formatted_faq_results.append(formatted_result)
-            faq_texts.append(formatted_result['chunk_text'])
-            if len(formatted_faq_results) == 3:
-                break
+    return [make_pdf_info(pdf['file_name'], pdf['start_page'], pdf['end_page'], category_name) for pdf in pdf_info]
+
+def make_pdf_info(file_name, start_page, end_page, category_name):
+    return {
+        "file_name": file_name,
+        "category": category_name,
+        "link_text": f"/manual/{category_name}/{file_name}, p.{start_page}-p.{end_page}",
+        "start_page": start_page,
+        "end_page": end_page,
+        "link": f"pdf/manual/{category_name}/{file_name}?start_page={start_page}&end_page={end_page}"
+    }
+
+async def process_search_results(question_vector, category, excluded_pages, page_chunks_task):
+    # Exclusions are applied in SQL; the extra candidates leave room for the diversity selection below
+    manual_rows, faq_rows = await asyncio.gather(
+        execute_search_query(question_vector, category, MANUAL_RESULT_LIMIT * MMR_CANDIDATE_MULTIPLIER, PDF_MANUAL_TABLE, excluded_pages),
+        execute_search_query(question_vector, category, FAQ_RESULT_LIMIT * MMR_CANDIDATE_MULTIPLIER, PDF_FAQ_TABLE, excluded_pages)
+    )
+
+    # Hits that restate the routed page ranges, each other, or (for FAQs) the chosen manual chunks are dropped
+    context_embeddings = [to_numpy_vector(chunk[3]) for chunks in await page_chunks_task for chunk in chunks]
+    manual_rows = [
+        manual_rows[i] for i in select_diverse(
+            question_vector, [to_numpy_vector(row[-1]) for row in manual_rows], MANUAL_RESULT_LIMIT, context_embeddings
+        )
+    ]
+    context_embeddings += [to_numpy_vector(row[-1]) for row in manual_rows]
+    faq_rows = [
+        faq_rows[i] for i in select_diverse(
+            question_vector, [to_numpy_vector(row[-1]) for row in faq_rows], FAQ_RESULT_LIMIT, context_embeddings
+        )
+    ]
+
+    formatted_manual_results = [format_result(result, category, "manual") for result in manual_rows]
+    formatted_faq_results = [format_result(result, category, "faq") for result in faq_rows]
+    manual_texts = [result['chunk_text'] for result in formatted_manual_results]
+    faq_texts = [result['chunk_text'] for result in formatted_faq_results]
 
     return formatted_manual_results, formatted_faq_results, manual_texts, faq_texts
@@ -42,6 +42,16 @@ CSV_MANUAL_DIR = os.path.join(CSV_OUTPUT_DIR, "manual")
 CSV_FAQ_DIR = os.path.join(CSV_OUTPUT_DIR, "faq")
 TOC_XLSX_DIR = os.path.join(XLSX_INPUT_DIR, "toc")
 
+# Embedding snapshot shared with the backend (memory-mapped by the numpy search backend)
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "/snapshot")
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 2))
+
+# Page-range PDF cache shared with the backend (PDF_PAGE_CACHE_DIR, same layout as backend/utils/pdf_utils.py).
+# PDF_PAGE_CACHE_PREWARM: "toc" extracts every TOC entry range, "all" also every page referenced by a search chunk,
+# "none" leaves the cache to fill on demand
+PDF_PAGE_CACHE_DIR = os.getenv("PDF_PAGE_CACHE_DIR", "/pdf_cache")
+PDF_PAGE_CACHE_PREWARM = os.getenv("PDF_PAGE_CACHE_PREWARM", "toc").lower()
+
 # POSTGRES
 POSTGRES_DB = os.getenv("POSTGRES_DB", "aurora")
 POSTGRES_USER = os.getenv("POSTGRES_USER", "user")
@@ -52,17 +62,29 @@ POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", 5432))
 # pgvector settings
 OPERATOR = os.getenv("OPERATOR", "<#>")
 
+# Embedding column storage type ("vector": float32 with a halfvec expression index, "halfvec": native float16)
+EMBEDDING_STORAGE_TYPE = os.getenv("EMBEDDING_STORAGE_TYPE", "vector").lower()
+
 # Index settings
 INDEX_TYPE = os.getenv("INDEX_TYPE", "hnsw").lower()
 HNSW_SETTINGS = json.loads(os.getenv("HNSW_SETTINGS", '{"m": 16, "ef_construction": 256, "ef_search": 500}'))
 HNSW_M = HNSW_SETTINGS.get("m", 16)
 HNSW_EF_CONSTRUCTION = HNSW_SETTINGS.get("ef_construction", 256)
 HNSW_EF_SEARCH = HNSW_SETTINGS.get("ef_search", 500)
+HNSW_CANDIDATE_MULTIPLIER = HNSW_SETTINGS.get("candidate_multiplier", 10)
+
+# Search strategy ("hnsw": halfvec HNSW, "binary_rerank": binary-quantized HNSW prefilter + exact rerank,
+# "short_rerank": HNSW over the truncated embedding_short column + exact rerank)
+SEARCH_STRATEGY = os.getenv("SEARCH_STRATEGY", "hnsw").lower()
+
+# Dimensions of the Matryoshka-truncated embedding_short column (0: column not stored)
+SHORT_EMBEDDING_DIMENSIONS = int(os.getenv("SHORT_EMBEDDING_DIMENSIONS", 0))
 
 # PostgreSQL table settings
 DOCUMENT_TABLE = os.getenv("DOCUMENT_TABLE", "document_table")
 DOCUMENT_CATEGORY_TABLE = os.getenv("DOCUMENT_CATEGORY_TABLE","document_category_table")
 XLSX_TOC_TABLE = os.getenv("XLSX_TOC_TABLE", "xlsx_toc_table")
+XLSX_TOC_ENTRY_TABLE = os.getenv("XLSX_TOC_ENTRY_TABLE", "xlsx_toc_entry_table")
 PDF_MANUAL_TABLE = os.getenv("PDF_MANUAL_TABLE", "pdf_manual_table")
 PDF_FAQ_TABLE = os.getenv("PDF_FAQ_TABLE", "pdf_faq_table")
 
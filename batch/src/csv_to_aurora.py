@@ -1,9 +1,13 @@
 # batch/src/csv_to_aurora.py
 import os
+import json
+import numpy as np
 import pandas as pd
 from psycopg import sql
+from pgvector import HalfVector
+from pgvector.psycopg import register_vector
 import uuid
-from utils import get_db_connection, create_tables, create_index, get_table_count, process_file_common, calculate_checksum, get_current_datetime, get_file_name, get_business_category, setup_logging
+from utils import get_db_connection, create_tables, create_index, get_embedding_column_type, truncate_embedding, get_table_count, process_file_common, calculate_checksum, get_current_datetime, get_file_name, get_business_category, setup_logging
 from config import *
 
 logger = setup_logging("csv_to_aurora")
@@ -24,38 +28,60 @@ def process_csv_file(file_path, cursor, table_name, document_type):
     business_category = get_business_category(file_path, CSV_MANUAL_DIR if document_type == 'manual' else CSV_FAQ_DIR)
     document_table_id = process_file_common(cursor, df['file_path'].iloc[0], file_name, DOCUMENT_TYPE_PDF_MANUAL if document_type == 'manual' else DOCUMENT_TYPE_PDF_FAQ, checksum, created_date_time, business_category)
 
+    embedding_type = sql.SQL(get_embedding_column_type())
+    if SHORT_EMBEDDING_DIMENSIONS > 0:
+        short_column = sql.SQL(", embedding_short")
+        short_value = sql.SQL(", %b::halfvec({})").format(sql.Literal(SHORT_EMBEDDING_DIMENSIONS))
+        short_update = sql.SQL("embedding_short = EXCLUDED.embedding_short,")
+    else:
+        short_column = short_value = short_update = sql.SQL("")
+
     if table_name == PDF_MANUAL_TABLE:
         insert_query = sql.SQL("""
         INSERT INTO {}
-        (id, document_table_id, chunk_no, document_page, chunk_text, embedding, created_date_time)
-        VALUES (%s, %s, %s, %s, %s, %s::vector(3072), %s)
+        (id, document_table_id, chunk_no, document_page, chunk_text, embedding{}, created_date_time)
+        VALUES (%s, %s, %s, %s, %s, %b::{}{}, %s)
         ON CONFLICT (document_table_id, chunk_no) DO UPDATE SET
         document_page = EXCLUDED.document_page,
         chunk_text = EXCLUDED.chunk_text,
         embedding = EXCLUDED.embedding,
+        {}
         created_date_time = EXCLUDED.created_date_time;
-        """).format(sql.Identifier(table_name))
+        """).format(sql.Identifier(table_name), short_column, embedding_type, short_value, short_update)
     else:  # PDF_FAQ_TABLE
         insert_query = sql.SQL("""
         INSERT INTO {}
-        (id, document_table_id, chunk_no, document_page, faq_no, chunk_text, embedding, created_date_time)
-        VALUES (%s, %s, %s, %s, %s, %s, %s::vector(3072), %s)
+        (id, document_table_id, chunk_no, document_page, faq_no, chunk_text, embedding{}, created_date_time)
+        VALUES (%s, %s, %s, %s, %s, %s, %b::{}{}, %s)
         ON CONFLICT (document_table_id, chunk_no) DO UPDATE SET
         document_page = EXCLUDED.document_page,
         faq_no = EXCLUDED.faq_no,
         chunk_text = EXCLUDED.chunk_text,
         embedding = EXCLUDED.embedding,
+        {}
         created_date_time = EXCLUDED.created_date_time;
-        """).format(sql.Identifier(table_name))
+        """).format(sql.Identifier(table_name), short_column, embedding_type, short_value, short_update)
 
     data = []
     for _, row in df.iterrows():
         embedding = row['embedding']
         if isinstance(embedding, str):
-            embedding = eval(embedding)
+            embedding = json.loads(embedding)
+        # NumPy arrays are sent in pgvector's binary format instead of as text
+        embedding = np.asarray(embedding, dtype=np.float32)
         if len(embedding) != 3072:
             logger.warning(f"Incorrect vector dimension for row in {file_path}. Expected 3072, got {len(embedding)}. Skipping.")
             continue
+        short_values = []
+        if SHORT_EMBEDDING_DIMENSIONS > 0:
+            short_embedding = row.get('embedding_short')
+            if isinstance(short_embedding, str):
+                short_embedding = np.asarray(json.loads(short_embedding), dtype=np.float32)
+            else:
+                short_embedding = truncate_embedding(embedding)
+            short_values.append(HalfVector(short_embedding))
+        if EMBEDDING_STORAGE_TYPE == "halfvec":
+            embedding = HalfVector(embedding)
 
         if table_name == PDF_MANUAL_TABLE:
             row_data = (
@@ -65,6 +91,7 @@ def process_csv_file(file_path, cursor, table_name, document_type):
                 row['document_page'],
                 row['chunk_text'],
                 embedding,
+                *short_values,
                 row['created_date_time']
             )
         else:  # PDF_FAQ_TABLE
@@ -76,6 +103,7 @@ def process_csv_file(file_path, cursor, table_name, document_type):
                 row['faq_no'],
                 row['chunk_text'],
                 embedding,
+                *short_values,
                 row['created_date_time']
             )
 
@@ -112,6 +140,8 @@ def process_csv_files():
                     conn.commit()
                     logger.info("Tables and indexes created successfully")
 
+                    register_vector(conn)
+
                     logger.info(f"Processing manual CSVs from: {CSV_MANUAL_DIR}")
                     process_directory(cursor, CSV_MANUAL_DIR, PDF_MANUAL_TABLE, "manual")
 
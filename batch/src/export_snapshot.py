@@ -0,0 +1,217 @@
+# batch/src/export_snapshot.py
+import os
+import json
+import shutil
+import numpy as np
+import psycopg
+from psycopg import sql
+from pgvector.psycopg import register_vector
+from utils import get_db_connection, get_current_datetime, setup_logging
+from config import *
+
+logger = setup_logging("export_snapshot")
+
+# Per-chunk number stored next to the page (chunk_no for manuals, faq_no for FAQs)
+SNAPSHOT_NUMBER_COLUMNS = {
+    PDF_MANUAL_TABLE: "chunk_no",
+    PDF_FAQ_TABLE: "faq_no"
+}
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+def get_document_version(cursor):
+    # Same value as the backend's get_document_version, so workers can tell whether a snapshot is current
+    cursor.execute(sql.SQL("""
+    SELECT COUNT(*), md5(COALESCE(string_agg(id::text || checksum, ',' ORDER BY id), ''))
+    FROM {}
+    """).format(sql.Identifier(DOCUMENT_TABLE)))
+    count, checksum_digest = cursor.fetchone()
+    return f"{count}:{checksum_digest}"
+
+def load_documents(cursor):
+    cursor.execute(sql.SQL("""
+    SELECT dt.id, dt.file_path, dt.file_name, dt.document_type, dt.checksum,
+           COALESCE(array_agg(dct.business_category ORDER BY dct.business_category)
+                    FILTER (WHERE dct.business_category IS NOT NULL), '{{}}')
+    FROM {document_table} dt
+    LEFT JOIN {document_category_table} dct ON dt.id = dct.document_table_id
+    GROUP BY dt.id
+    ORDER BY dt.id
+    """).format(
+        document_table=sql.Identifier(DOCUMENT_TABLE),
+        document_category_table=sql.Identifier(DOCUMENT_CATEGORY_TABLE)
+    ))
+    return [
+        {
+            "id": str(document_table_id),
+            "file_path": file_path,
+            "file_name": file_name,
+            "document_type": document_type,
+            "checksum": checksum,
+            "categories": list(categories)
+        }
+        for document_table_id, file_path, file_name, document_type, checksum, categories in cursor.fetchall()
+    ]
+
+def read_current_version():
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, CURRENT_FILE)) as f:
+            version = f.read().strip()
+        with open(os.path.join(SNAPSHOT_DIR, version, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def to_float16(embedding):
+    if hasattr(embedding, "to_numpy"):
+        embedding = embedding.to_numpy()
+    return np.asarray(embedding, dtype=np.float16)
+
+def export_table(conn, table_name, snapshot_path, document_indexes):
+    """Write one table's chunks as row-aligned arrays, ordered by category so each category is a contiguous slice."""
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("""
+        SELECT COUNT(*), MAX(vector_dims(t.embedding))
+        FROM {table} t
+        JOIN {document_category_table} c ON t.document_table_id = c.document_table_id
+        """).format(
+            table=sql.Identifier(table_name),
+            document_category_table=sql.Identifier(DOCUMENT_CATEGORY_TABLE)
+        ))
+        row_count, dimensions = cursor.fetchone()
+
+    if row_count == 0:
+        logger.info(f"No chunks in {table_name}. Skipping.")
+        return {"rows": 0, "dimensions": 0}
+
+    prefix = os.path.join(snapshot_path, table_name)
+    embeddings = np.lib.format.open_memmap(f"{prefix}.embeddings.npy", mode="w+", dtype=np.float16, shape=(row_count, dimensions))
+    categories = np.empty(row_count, dtype=np.int16)
+    row_document_indexes = np.empty(row_count, dtype=np.int32)
+    pages = np.empty(row_count, dtype=np.int32)
+    numbers = np.empty(row_count, dtype=np.int32)
+    text_offsets = np.zeros(row_count + 1, dtype=np.int64)
+
+    query = sql.SQL("""
+    SELECT c.business_category, t.document_table_id, t.document_page, t.{number_column}, t.chunk_text, t.embedding
+    FROM {table} t
+    JOIN {document_category_table} c ON t.document_table_id = c.document_table_id
+    ORDER BY c.business_category, t.document_table_id, t.chunk_no
+    """).format(
+        number_column=sql.Identifier(SNAPSHOT_NUMBER_COLUMNS[table_name]),
+        table=sql.Identifier(table_name),
+        document_category_table=sql.Identifier(DOCUMENT_CATEGORY_TABLE)
+    )
+
+    # A named (server-side) cursor streams the rows, so the batch never holds the whole table in memory
+    with open(f"{prefix}.text.bin", "wb") as text_file, conn.cursor(name=f"export_{table_name}") as cursor:
+        cursor.itersize = BATCH_SIZE
+        cursor.execute(query)
+        position = 0
+        for business_category, document_table_id, document_page, number, chunk_text, embedding in cursor:
+            if position >= row_count:
+                raise RuntimeError(f"{table_name} returned more rows than counted ({row_count})")
+            encoded_text = chunk_text.encode("utf-8")
+            text_file.write(encoded_text)
+
+            categories[position] = business_category
+            row_document_indexes[position] = document_indexes[str(document_table_id)]
+            pages[position] = document_page
+            numbers[position] = number
+            text_offsets[position + 1] = text_offsets[position] + len(encoded_text)
+            embeddings[position] = to_float16(embedding)
+            position += 1
+
+    if position != row_count:
+        raise RuntimeError(f"{table_name} returned {position} rows, expected {row_count}")
+
+    embeddings.flush()
+    del embeddings
+    np.save(f"{prefix}.categories.npy", categories)
+    np.save(f"{prefix}.document_indexes.npy", row_document_indexes)
+    np.save(f"{prefix}.pages.npy", pages)
+    np.save(f"{prefix}.numbers.npy", numbers)
+    np.save(f"{prefix}.text_offsets.npy", text_offsets)
+
+    logger.info(f"Exported {row_count} chunks from {table_name} ({dimensions} dimensions)")
+    return {"rows": row_count, "dimensions": dimensions}
+
+def fsync_directory(path):
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), "rb") as f:
+            os.fsync(f.fileno())
+
+def switch_current_version(version):
+    # os.replace is atomic, so a worker reads either the old or the new version name, never a partial one
+    temp_path = os.path.join(SNAPSHOT_DIR, f".{CURRENT_FILE}.tmp")
+    with open(temp_path, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(SNAPSHOT_DIR, CURRENT_FILE))
+
+def remove_old_snapshots(current_version):
+    # Workers still mapping a removed version keep reading it until they switch; unlinked files stay valid while mapped
+    versions = sorted(
+        name for name in os.listdir(SNAPSHOT_DIR)
+        if not name.startswith(".") and os.path.isdir(os.path.join(SNAPSHOT_DIR, name))
+    )
+    for version in versions[:-SNAPSHOT_KEEP] if SNAPSHOT_KEEP > 0 else []:
+        if version != current_version:
+            shutil.rmtree(os.path.join(SNAPSHOT_DIR, version), ignore_errors=True)
+            logger.info(f"Removed old snapshot {version}")
+
+def main():
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+
+    with get_db_connection() as conn:
+        # One consistent view of the tables for the metadata, counts and rows
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+        conn.read_only = True
+        register_vector(conn)
+
+        with conn.cursor() as cursor:
+            document_version = get_document_version(cursor)
+            current = read_current_version()
+            if current and current["document_version"] == document_version:
+                logger.info(f"Snapshot {current['version']} already matches document version {document_version}. Skipping.")
+                return
+            documents = load_documents(cursor)
+
+        version = get_current_datetime().strftime("%Y%m%d%H%M%S%f")
+        temp_path = os.path.join(SNAPSHOT_DIR, f".{version}.tmp")
+        os.makedirs(temp_path)
+        try:
+            document_indexes = {document["id"]: i for i, document in enumerate(documents)}
+            tables = {
+                table_name: export_table(conn, table_name, temp_path, document_indexes)
+                for table_name in [PDF_MANUAL_TABLE, PDF_FAQ_TABLE]
+            }
+            conn.rollback()
+
+            manifest = {
+                "version": version,
+                "document_version": document_version,
+                "created_date_time": get_current_datetime().isoformat(),
+                "documents": documents,
+                "tables": tables
+            }
+            with open(os.path.join(temp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False)
+            fsync_directory(temp_path)
+            os.rename(temp_path, os.path.join(SNAPSHOT_DIR, version))
+        except Exception:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+
+    switch_current_version(version)
+    logger.info(f"Snapshot {version} is now current (document version {document_version})")
+    remove_old_snapshots(version)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logger.error(f"Script execution failed: {e}", exc_info=True)
+        exit(1)
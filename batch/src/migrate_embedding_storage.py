@@ -0,0 +1,67 @@
+# batch/src/migrate_embedding_storage.py
+import psycopg
+from psycopg import sql
+from utils import get_db_connection, create_index, get_embedding_column_type, get_index_name, get_binary_index_name, setup_logging
+from config import *
+
+logger = setup_logging("migrate_embedding_storage")
+
+def get_embedding_column_definition(cursor, table_name):
+    cursor.execute("""
+    SELECT format_type(a.atttypid, a.atttypmod)
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    WHERE c.relname = %s AND a.attname = 'embedding' AND NOT a.attisdropped
+    """, (table_name,))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+def migrate_table(cursor, table_name):
+    current_type = get_embedding_column_definition(cursor, table_name)
+    target_type = get_embedding_column_type()
+
+    if current_type is None:
+        logger.warning(f"Table {table_name} has no embedding column. Skipping.")
+        return False
+    if current_type.lower() == target_type.lower():
+        logger.info(f"{table_name}.embedding is already {target_type}. Skipping.")
+        return False
+
+    logger.info(f"Migrating {table_name}.embedding from {current_type} to {target_type}")
+
+    # The old indexes are built on the old column expression and have to be rebuilt
+    cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(get_index_name(table_name))))
+    cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(get_binary_index_name(table_name))))
+    cursor.execute(sql.SQL("ALTER TABLE {} ALTER COLUMN embedding TYPE {} USING embedding::{}").format(
+        sql.Identifier(table_name),
+        sql.SQL(target_type),
+        sql.SQL(target_type)
+    ))
+    create_index(cursor, table_name)
+    # ALTER COLUMN TYPE rewrites the table, so only the statistics need refreshing
+    cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table_name)))
+    logger.info(f"Migrated {table_name}.embedding to {target_type}")
+    return True
+
+def main():
+    logger.info(f"Migrating embedding columns to EMBEDDING_STORAGE_TYPE={EMBEDDING_STORAGE_TYPE}")
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            for table_name in [PDF_MANUAL_TABLE, PDF_FAQ_TABLE]:
+                try:
+                    migrate_table(cursor, table_name)
+                    conn.commit()
+                except psycopg.Error as e:
+                    conn.rollback()
+                    logger.error(f"Error migrating {table_name}: {e}")
+                    raise
+
+    logger.info("Embedding storage migration completed.")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logger.error(f"Script execution failed: {e}", exc_info=True)
+        exit(1)
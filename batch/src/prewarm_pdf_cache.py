@@ -0,0 +1,130 @@
+# batch/src/prewarm_pdf_cache.py
+import os
+import shutil
+from io import BytesIO
+import psycopg
+from psycopg import sql
+from pypdf import PdfReader, PdfWriter
+from utils import get_db_connection, calculate_checksum, setup_logging
+from config import *
+
+logger = setup_logging("prewarm_pdf_cache")
+
+def get_cache_path(checksum, start_page, end_page):
+    # Same layout as backend/utils/pdf_utils.py get_disk_cache_path
+    return os.path.join(PDF_PAGE_CACHE_DIR, checksum[:2], checksum, f"{start_page}-{end_page}.pdf")
+
+def load_pdf_documents(cursor):
+    cursor.execute(sql.SQL("""
+    SELECT id, file_path, file_name, document_type
+    FROM {}
+    WHERE document_type IN (%s, %s)
+    ORDER BY id
+    """).format(sql.Identifier(DOCUMENT_TABLE)), (DOCUMENT_TYPE_PDF_MANUAL, DOCUMENT_TYPE_PDF_FAQ))
+    return cursor.fetchall()
+
+def load_toc_ranges(cursor):
+    """Page ranges the backend links to from TOC routing, per PDF file name."""
+    try:
+        cursor.execute(sql.SQL("""
+        SELECT DISTINCT pdf_file_name, start_page, end_page
+        FROM {}
+        """).format(sql.Identifier(XLSX_TOC_ENTRY_TABLE)))
+    except psycopg.errors.UndefinedTable:
+        cursor.connection.rollback()
+        logger.warning(f"{XLSX_TOC_ENTRY_TABLE} does not exist. Skipping TOC ranges.")
+        return {}
+    ranges = {}
+    for pdf_file_name, start_page, end_page in cursor.fetchall():
+        ranges.setdefault(pdf_file_name, set()).add((start_page, end_page))
+    return ranges
+
+def load_result_pages(cursor):
+    """Single pages the backend links to from manual and FAQ search results, per document."""
+    pages = {}
+    for table_name in [PDF_MANUAL_TABLE, PDF_FAQ_TABLE]:
+        cursor.execute(sql.SQL("""
+        SELECT DISTINCT document_table_id, document_page
+        FROM {}
+        """).format(sql.Identifier(table_name)))
+        for document_table_id, document_page in cursor.fetchall():
+            pages.setdefault(document_table_id, set()).add((document_page, document_page))
+    return pages
+
+def write_ranges(file_path, checksum, ranges):
+    pdf_reader = None
+    written = 0
+    for start_page, end_page in sorted(ranges):
+        cache_path = get_cache_path(checksum, start_page, end_page)
+        if os.path.exists(cache_path):
+            continue
+        if pdf_reader is None:
+            pdf_reader = PdfReader(file_path)
+        if not 1 <= start_page <= len(pdf_reader.pages):
+            logger.warning(f"Skipping invalid page range {start_page}-{end_page} for {file_path}")
+            continue
+
+        pdf_writer = PdfWriter()
+        for page_num in range(start_page - 1, min(end_page, len(pdf_reader.pages))):
+            pdf_writer.add_page(pdf_reader.pages[page_num])
+        pdf_bytes = BytesIO()
+        pdf_writer.write(pdf_bytes)
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(pdf_bytes.getvalue())
+        os.replace(temp_path, cache_path)
+        written += 1
+    return written
+
+def remove_stale_entries(checksums):
+    # Entries of sources that changed or were removed are never requested again
+    for prefix in os.listdir(PDF_PAGE_CACHE_DIR):
+        prefix_path = os.path.join(PDF_PAGE_CACHE_DIR, prefix)
+        if not os.path.isdir(prefix_path):
+            continue
+        for checksum in os.listdir(prefix_path):
+            if checksum not in checksums:
+                shutil.rmtree(os.path.join(prefix_path, checksum), ignore_errors=True)
+                logger.info(f"Removed cached pages of {checksum}")
+
+def main():
+    if PDF_PAGE_CACHE_PREWARM == "none" or not PDF_PAGE_CACHE_DIR:
+        logger.info("PDF page cache prewarming is disabled. Skipping.")
+        return
+    os.makedirs(PDF_PAGE_CACHE_DIR, exist_ok=True)
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            documents = load_pdf_documents(cursor)
+            toc_ranges = load_toc_ranges(cursor)
+            result_pages = load_result_pages(cursor) if PDF_PAGE_CACHE_PREWARM == "all" else {}
+
+    checksums = set()
+    total_written = 0
+    for document_table_id, file_path, file_name, document_type in documents:
+        if not os.path.exists(file_path):
+            logger.warning(f"PDF file not found: {file_path}")
+            continue
+        # Keyed by the PDF's own checksum, which the backend computes from the file it serves
+        checksum = calculate_checksum(file_path)
+        checksums.add(checksum)
+
+        ranges = set(result_pages.get(document_table_id, set()))
+        if document_type == DOCUMENT_TYPE_PDF_MANUAL:
+            ranges |= toc_ranges.get(file_name, set())
+        try:
+            total_written += write_ranges(file_path, checksum, ranges)
+        except Exception as e:
+            logger.error(f"Error prewarming PDF page cache for {file_path}: {e}")
+
+    remove_stale_entries(checksums)
+    logger.info(f"PDF page cache prewarmed: {total_written} ranges written for {len(checksums)} PDFs")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logger.error(f"Script execution failed: {e}", exc_info=True)
+        exit(1)
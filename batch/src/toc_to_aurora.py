@@ -1,13 +1,110 @@
 # batch/src/toc_to_aurora.py
 import os
+import numpy as np
 import pandas as pd
 from psycopg import sql
+from openai import AzureOpenAI
+from pgvector import HalfVector
+from pgvector.psycopg import register_vector
 import uuid
-from utils import get_db_connection, create_tables, get_table_count, process_file_common, calculate_checksum, get_current_datetime, get_file_name, get_business_category, setup_logging
+from utils import get_db_connection, create_tables, get_embedding_column_type, get_table_count, process_file_common, calculate_checksum, get_current_datetime, get_file_name, get_business_category, setup_logging
 from config import *
 
 logger = setup_logging("toc_to_aurora")
 
+# XLSX column -> XLSX_TOC_ENTRY_TABLE column
+TOC_ENTRY_COLUMNS = {
+    "マニュアル区分": "manual_type",
+    "章": "chapter",
+    "節": "section",
+    "詳細": "detail",
+    "ページ(目次/フッター)": "toc_page",
+    "PDFファイル名": "pdf_file_name",
+    "PDF開始ページ": "start_page",
+    "PDF終了ページ": "end_page"
+}
+
+# Placeholder cell values that carry no meaning for the entry embedding
+EMPTY_TOC_VALUES = {"", "なし", "特になし"}
+
+# Entry texts sent per embeddings request
+EMBEDDING_BATCH_SIZE = 256
+
+client = AzureOpenAI(
+    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+    api_key=AZURE_OPENAI_API_KEY,
+    api_version=AZURE_OPENAI_API_VERSION
+)
+
+def build_toc_entries(df):
+    missing_columns = [column for column in TOC_ENTRY_COLUMNS if column not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Missing TOC columns: {', '.join(missing_columns)}")
+
+    entries = []
+    for entry_no, row in enumerate(df.to_dict("records"), start=1):
+        entry = {
+            column: "" if pd.isna(row[xlsx_column]) else str(row[xlsx_column]).strip()
+            for xlsx_column, column in TOC_ENTRY_COLUMNS.items()
+        }
+        entry["entry_no"] = entry_no
+        entry["start_page"] = int(row["PDF開始ページ"])
+        entry["end_page"] = int(row["PDF終了ページ"])
+        # The manual title gives short section names ("1. 食事") the context they lack on their own
+        manual_title = os.path.splitext(entry["pdf_file_name"])[0]
+        entry["entry_text"] = " ".join(
+            value for value in [manual_title, entry["chapter"], entry["section"], entry["detail"]]
+            if value not in EMPTY_TOC_VALUES
+        )
+        entries.append(entry)
+    return entries
+
+def create_entry_embeddings(entries):
+    embeddings = []
+    for start in range(0, len(entries), EMBEDDING_BATCH_SIZE):
+        response = client.embeddings.create(
+            input=[entry["entry_text"] for entry in entries[start:start + EMBEDDING_BATCH_SIZE]],
+            model=AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT
+        )
+        embeddings.extend(np.asarray(item.embedding, dtype=np.float32) for item in sorted(response.data, key=lambda item: item.index))
+    if EMBEDDING_STORAGE_TYPE == "halfvec":
+        return [HalfVector(embedding) for embedding in embeddings]
+    return embeddings
+
+def insert_toc_entries(cursor, document_table_id, entries, created_date_time):
+    # The entry set of a TOC file is replaced as a whole, since rows can be added or removed
+    cursor.execute(sql.SQL("DELETE FROM {} WHERE document_table_id = %s").format(sql.Identifier(XLSX_TOC_ENTRY_TABLE)), (document_table_id,))
+    if not entries:
+        return
+
+    embeddings = create_entry_embeddings(entries)
+    insert_entry_query = sql.SQL("""
+    INSERT INTO {}
+    (id, document_table_id, entry_no, manual_type, chapter, section, detail, toc_page, pdf_file_name, start_page, end_page, entry_text, embedding, created_date_time)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %b::{}, %s)
+    """).format(sql.Identifier(XLSX_TOC_ENTRY_TABLE), sql.SQL(get_embedding_column_type()))
+
+    cursor.executemany(insert_entry_query, [
+        (
+            uuid.uuid4(),
+            document_table_id,
+            entry["entry_no"],
+            entry["manual_type"],
+            entry["chapter"],
+            entry["section"],
+            entry["detail"],
+            entry["toc_page"],
+            entry["pdf_file_name"],
+            entry["start_page"],
+            entry["end_page"],
+            entry["entry_text"],
+            embedding,
+            created_date_time
+        )
+        for entry, embedding in zip(entries, embeddings)
+    ])
+    logger.info(f"Inserted {len(entries)} TOC entries into {XLSX_TOC_ENTRY_TABLE}")
+
 def process_xlsx_file(file_path, cursor):
     logger.info(f"Processing XLSX file: {file_path}")
     try:
@@ -52,6 +149,12 @@ def process_xlsx_file(file_path, cursor):
         logger.error(f"Error inserting/updating TOC data in {XLSX_TOC_TABLE}: {e}")
         raise
 
+    try:
+        insert_toc_entries(cursor, document_table_id, build_toc_entries(df), created_date_time)
+    except Exception as e:
+        logger.error(f"Error inserting TOC entries into {XLSX_TOC_ENTRY_TABLE}: {e}")
+        raise
+
 def process_toc_files():
     try:
         with get_db_connection() as conn:
@@ -61,6 +164,7 @@ def process_toc_files():
                     create_tables(cursor)
                     conn.commit()
                     logger.info("Tables created successfully")
+                    register_vector(conn)
 
                     xlsx_files = []
                     for root, _, files in os.walk(TOC_XLSX_DIR):
@@ -87,7 +191,7 @@ def process_toc_files():
                     logger.error(f"Transaction rolled back due to error: {e}")
                     raise
 
-                for table_name in [DOCUMENT_TABLE, XLSX_TOC_TABLE]:
+                for table_name in [DOCUMENT_TABLE, XLSX_TOC_TABLE, XLSX_TOC_ENTRY_TABLE]:
                     get_table_count(cursor, table_name)
 
     except Exception as e:
@@ -8,6 +8,7 @@ import uuid
 import pytz
 from datetime import datetime
 import hashlib
+import numpy as np
 from config import *
 
 def setup_logging(module_name):
@@ -94,7 +95,7 @@ def create_tables(cursor):
             chunk_no INTEGER NOT NULL,
             document_page SMALLINT NOT NULL,
             chunk_text TEXT NOT NULL,
-            embedding VECTOR(3072) NOT NULL,
+            embedding {embedding_type} NOT NULL,
             created_date_time TIMESTAMP WITH TIME ZONE NOT NULL,
             UNIQUE(document_table_id, chunk_no)
         )
@@ -107,7 +108,7 @@ def create_tables(cursor):
             document_page SMALLINT NOT NULL,
             faq_no SMALLINT NOT NULL,
             chunk_text TEXT NOT NULL,
-            embedding VECTOR(3072) NOT NULL,
+            embedding {embedding_type} NOT NULL,
             created_date_time TIMESTAMP WITH TIME ZONE NOT NULL,
             UNIQUE(document_table_id, chunk_no)
         )
@@ -122,25 +123,139 @@ def create_tables(cursor):
             created_date_time TIMESTAMP WITH TIME ZONE NOT NULL,
             UNIQUE(document_table_id, file_name)
         )
+        """),
+        (XLSX_TOC_ENTRY_TABLE, """
+        CREATE TABLE IF NOT EXISTS {} (
+            id UUID PRIMARY KEY,
+            document_table_id UUID NOT NULL REFERENCES {}(id),
+            entry_no INTEGER NOT NULL,
+            manual_type VARCHAR(256) NOT NULL,
+            chapter TEXT NOT NULL,
+            section TEXT NOT NULL,
+            detail TEXT NOT NULL,
+            toc_page VARCHAR(64) NOT NULL,
+            pdf_file_name VARCHAR(1024) NOT NULL,
+            start_page SMALLINT NOT NULL,
+            end_page SMALLINT NOT NULL,
+            entry_text TEXT NOT NULL,
+            embedding {embedding_type} NOT NULL,
+            created_date_time TIMESTAMP WITH TIME ZONE NOT NULL,
+            UNIQUE(document_table_id, entry_no)
+        )
         """)
     ]
 
     for table_name, create_query in tables:
         formatted_query = sql.SQL(create_query).format(
             sql.Identifier(table_name),
-            sql.Identifier(DOCUMENT_TABLE)
+            sql.Identifier(DOCUMENT_TABLE),
+            embedding_type=sql.SQL(get_embedding_column_type())
         )
         create_table(cursor, table_name, formatted_query)
 
+    if SHORT_EMBEDDING_DIMENSIONS > 0:
+        for table_name in [PDF_MANUAL_TABLE, PDF_FAQ_TABLE]:
+            add_short_embedding_column(cursor, table_name)
+
+def add_short_embedding_column(cursor, table_name):
+    # Existing rows are backfilled from the full embedding (truncate + renormalize, pgvector 0.7.0+)
+    try:
+        cursor.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS embedding_short HALFVEC({})").format(
+            sql.Identifier(table_name),
+            sql.Literal(SHORT_EMBEDDING_DIMENSIONS)
+        ))
+        cursor.execute(sql.SQL("""
+        UPDATE {} SET embedding_short = l2_normalize(subvector(embedding::halfvec(3072), 1, {}))
+        WHERE embedding_short IS NULL
+        """).format(
+            sql.Identifier(table_name),
+            sql.Literal(SHORT_EMBEDDING_DIMENSIONS)
+        ))
+        logger.info(f"embedding_short column ({SHORT_EMBEDDING_DIMENSIONS} dims) ready on {table_name}")
+    except psycopg.Error as e:
+        logger.error(f"Error adding embedding_short column to {table_name}: {e}")
+        raise
+
+def truncate_embedding(embedding, dimensions=SHORT_EMBEDDING_DIMENSIONS):
+    """Matryoshka truncation: keep the leading dimensions and renormalize to unit length."""
+    short_embedding = np.asarray(embedding, dtype=np.float32)[:dimensions]
+    norm = np.linalg.norm(short_embedding)
+    return short_embedding / norm if norm > 0 else short_embedding
+
+def get_embedding_column_type():
+    if EMBEDDING_STORAGE_TYPE == "halfvec":
+        return "HALFVEC(3072)"
+    elif EMBEDDING_STORAGE_TYPE == "vector":
+        return "VECTOR(3072)"
+    raise ValueError(f"Unsupported EMBEDDING_STORAGE_TYPE: {EMBEDDING_STORAGE_TYPE}")
+
+def get_index_name(table_name):
+    return f"hnsw_{table_name}_embedding_idx"
+
+def get_binary_index_name(table_name):
+    return f"hnsw_{table_name}_embedding_bit_idx"
+
+def get_short_index_name(table_name):
+    return f"hnsw_{table_name}_embedding_short_idx"
+
+def create_short_index(cursor, table_name):
+    index_name = get_short_index_name(table_name)
+    index_query = sql.SQL("""
+    CREATE INDEX IF NOT EXISTS {} ON {}
+    USING hnsw(embedding_short halfvec_ip_ops)
+    WITH (m = {}, ef_construction = {});
+    """).format(
+        sql.Identifier(index_name),
+        sql.Identifier(table_name),
+        sql.Literal(HNSW_M),
+        sql.Literal(HNSW_EF_CONSTRUCTION)
+    )
+    try:
+        cursor.execute(index_query)
+        logger.info(f"embedding_short HNSW index creation query executed for {table_name}")
+    except psycopg.Error as e:
+        logger.error(f"Error creating embedding_short HNSW index for {table_name}: {e}")
+        raise
+
+def create_binary_index(cursor, table_name):
+    index_name = get_binary_index_name(table_name)
+    # Must match the prefilter expression used by the backend's binary_rerank search
+    index_query = sql.SQL("""
+    CREATE INDEX IF NOT EXISTS {} ON {}
+    USING hnsw((binary_quantize(embedding)::bit(3072)) bit_hamming_ops)
+    WITH (m = {}, ef_construction = {});
+    """).format(
+        sql.Identifier(index_name),
+        sql.Identifier(table_name),
+        sql.Literal(HNSW_M),
+        sql.Literal(HNSW_EF_CONSTRUCTION)
+    )
+    try:
+        cursor.execute(index_query)
+        logger.info(f"Binary quantized HNSW index creation query executed for {table_name}")
+    except psycopg.Error as e:
+        logger.error(f"Error creating binary quantized HNSW index for {table_name}: {e}")
+        raise
+
 def create_index(cursor, table_name):
-    index_name = f"hnsw_{table_name}_embedding_idx"
+    if SHORT_EMBEDDING_DIMENSIONS > 0:
+        create_short_index(cursor, table_name)
+
+    if SEARCH_STRATEGY == "binary_rerank":
+        create_binary_index(cursor, table_name)
+
+    # The full halfvec index is built under every SEARCH_STRATEGY, so switching back to hnsw needs no rebuild
+    index_name = get_index_name(table_name)
+    # A native halfvec column is indexed directly; a vector column through a halfvec expression
+    embedding_expression = "embedding" if EMBEDDING_STORAGE_TYPE == "halfvec" else "(embedding::halfvec(3072))"
     index_query = sql.SQL("""
     CREATE INDEX IF NOT EXISTS {} ON {}
-    USING hnsw((embedding::halfvec(3072)) halfvec_ip_ops)
+    USING hnsw({} halfvec_ip_ops)
     WITH (m = {}, ef_construction = {});
     """).format(
         sql.Identifier(index_name),
         sql.Identifier(table_name),
+        sql.SQL(embedding_expression),
         sql.Literal(HNSW_M),
         sql.Literal(HNSW_EF_CONSTRUCTION)
     )
@@ -6,7 +6,7 @@ from openai import AzureOpenAI
 import traceback
 import re
 from langchain_text_splitters import CharacterTextSplitter
-from utils import calculate_checksum, get_current_datetime, get_file_name, get_business_category, setup_logging
+from utils import calculate_checksum, get_current_datetime, get_file_name, get_business_category, truncate_embedding, setup_logging
 from config import *
 
 logger = setup_logging("vectorizer")
@@ -80,6 +80,11 @@ def split_text_into_chunks(text):
     chunks = text_splitter.split_text(text)
     return chunks if chunks else [text]
 
+def add_short_embedding(data):
+    if SHORT_EMBEDDING_DIMENSIONS > 0:
+        data['embedding_short'] = truncate_embedding(data['embedding']).tolist()
+    return data
+
 def process_manual_page(page_text, page_num, file_info, chunk_counter):
     chunks = split_text_into_chunks(page_text)
     processed_data = []
@@ -101,7 +106,7 @@ def process_manual_page(page_text, page_num, file_info, chunk_counter):
             'created_date_time': file_info['created_date_time'],
             'embedding': response.data[0].embedding
         }
-        processed_data.append(data)
+        processed_data.append(add_short_embedding(data))
         chunk_counter += 1
     return processed_data, chunk_counter
 
@@ -125,7 +130,7 @@ def process_faq_page(page_text, page_num, file_info, chunk_counter):
         'created_date_time': file_info['created_date_time'],
         'embedding': response.data[0].embedding
     }
-    return [data], chunk_counter + 1
+    return [add_short_embedding(data)], chunk_counter + 1
 
 def process_pdf(file_path, category, document_type):
     logger.info(f"Processing {document_type} PDF: {file_path}")
@@ -2,44 +2,97 @@
 from fastapi import FastAPI, WebSocket, Request, WebSocketDisconnect, HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
 import os
 import websockets
 import asyncio
 import logging
+import time
 import httpx
-import json
+from contextlib import asynccontextmanager
 from urllib.parse import unquote, quote
+from upstream_pool import UpstreamPool
+
+# Conditional and Range request headers go to the backend; its validators and range headers come back
+FORWARDED_REQUEST_HEADERS = ("if-none-match", "if-modified-since", "range", "if-range")
+FORWARDED_RESPONSE_HEADERS = (
+    "etag", "last-modified", "cache-control", "accept-ranges", "content-range", "content-length", "content-disposition"
+)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
 BACKEND_URL = os.getenv("BACKEND_URL", "ws://backend:8001")
 BACKEND_HTTP_URL = os.getenv("BACKEND_HTTP_URL", "http://backend:8001")
+# "pooled": browser sockets share WS_UPSTREAM_POOL_SIZE backend connections; "direct": one backend connection per socket
+WS_UPSTREAM_MODE = os.getenv("WS_UPSTREAM_MODE", "pooled").lower()
+WS_UPSTREAM_POOL_SIZE = int(os.getenv("WS_UPSTREAM_POOL_SIZE", 4))
+# Frames queued for a browser socket before it is closed as too slow
+WS_CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", 1000))
+# Categories are fresh for CATEGORY_CACHE_TTL seconds, then served stale for up to CATEGORY_CACHE_STALE more while refreshed
+CATEGORY_CACHE_TTL = float(os.getenv("CATEGORY_CACHE_TTL", 300))
+CATEGORY_CACHE_STALE = float(os.getenv("CATEGORY_CACHE_STALE", 3600))
+
+upstream_pool = UpstreamPool(f"{BACKEND_URL}/ws", WS_UPSTREAM_POOL_SIZE, WS_CLIENT_QUEUE_SIZE)
+http_client = None
+_category_cache = {"categories": None, "loaded_at": 0.0, "refresh": None}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    # One keep-alive client for all backend calls (HTTP/2 is used when the backend offers it over TLS)
+    http_client = httpx.AsyncClient(http2=True, timeout=httpx.Timeout(30.0, connect=5.0))
+    try:
+        yield
+    finally:
+        await upstream_pool.close()
+        await http_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = Jinja2Templates(directory="templates")
 
 @app.get("/favicon.ico", include_in_schema=False)
 async def favicon():
     return FileResponse("/app/static/fastapi-1.svg", media_type="image/svg+xml")
 
-@app.get("/")
-async def read_root(request: Request):
+async def fetch_categories():
+    response = await http_client.get(f"{BACKEND_HTTP_URL}/categories")
+    response.raise_for_status()
+    categories = response.json()["categories"]
+    _category_cache.update(
+        categories=[{"name": name, "value": value} for name, value in categories.items()],
+        loaded_at=time.monotonic()
+    )
+
+async def refresh_categories():
+    try:
+        await fetch_categories()
+    except Exception as e:
+        logger.warning(f"Error refreshing categories, keeping the cached ones: {str(e)}")
+
+async def get_categories():
+    age = time.monotonic() - _category_cache["loaded_at"]
+    if _category_cache["categories"] is not None and age < CATEGORY_CACHE_TTL + CATEGORY_CACHE_STALE:
+        if age >= CATEGORY_CACHE_TTL and (_category_cache["refresh"] is None or _category_cache["refresh"].done()):
+            _category_cache["refresh"] = asyncio.create_task(refresh_categories())
+        return _category_cache["categories"]
+
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{BACKEND_HTTP_URL}/categories")
-            categories = response.json()["categories"]
-            categories = [{"name": name, "value": value} for name, value in categories.items()]
+        await fetch_categories()
     except Exception as e:
         logger.error(f"Error fetching categories: {str(e)}")
-        categories = []
+        return _category_cache["categories"] or []
+    return _category_cache["categories"]
 
+@app.get("/")
+async def read_root(request: Request):
+    categories = await get_categories()
     return templates.TemplateResponse("index.html", {"request": request, "categories": categories})
 
 @app.get("/pdf/{document_type}/{category}/{path:path}")
-async def stream_pdf(document_type: str, category: str, path: str, page: int = None, start_page: int = None, end_page: int = None):
+async def stream_pdf(request: Request, document_type: str, category: str, path: str, page: int = None, start_page: int = None, end_page: int = None):
     decoded_path = unquote(path)
     url = f"{BACKEND_HTTP_URL}/pdf/{document_type}/{category}/{quote(decoded_path)}"
     params = {}
@@ -52,37 +105,42 @@ async def stream_pdf(document_type: str, category: str, path: str, page: int = N
 
     logger.info(f"Proxying PDF from backend: {url}")
 
-    async def stream_response():
-        async with httpx.AsyncClient() as client:
-            async with client.stream('GET', url, params=params) as response:
-                if response.status_code == 200:
-                    async for chunk in response.aiter_bytes():
-                        yield chunk
-                else:
-                    error_content = await response.aread()
-                    error_message = error_content.decode('utf-8', errors='replace')
-                    logger.error(f"Error from backend: {error_message}")
-                    raise HTTPException(status_code=response.status_code, detail=error_message)
-
     try:
-        headers = {
-            "Content-Disposition": f'inline; filename*=UTF-8\'\'{quote(os.path.basename(decoded_path))}'
-        }
-        return StreamingResponse(
-            stream_response(),
-            media_type="application/pdf",
-            headers=headers
-        )
-    except httpx.HTTPStatusError as e:
+        request_headers = {name: request.headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request.headers}
+        backend_request = http_client.build_request('GET', url, params=params, headers=request_headers)
+        response = await http_client.send(backend_request, stream=True)
+    except httpx.HTTPError as e:
         logger.error(f"HTTP error occurred while fetching PDF: {str(e)}")
-        raise HTTPException(status_code=e.response.status_code, detail=str(e))
-    except Exception as e:
-        logger.error(f"Unexpected error occurred while fetching PDF: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=502, detail=str(e))
+
+    headers = {name: response.headers[name] for name in FORWARDED_RESPONSE_HEADERS if name in response.headers}
+    headers.setdefault("content-disposition", f'inline; filename*=UTF-8\'\'{quote(os.path.basename(decoded_path))}')
+
+    if response.status_code == 304:
+        await response.aclose()
+        return Response(status_code=304, headers=headers)
+    if response.status_code not in (200, 206):
+        error_content = await response.aread()
+        await response.aclose()
+        error_message = error_content.decode('utf-8', errors='replace')
+        logger.error(f"Error from backend: {error_message}")
+        raise HTTPException(status_code=response.status_code, detail=error_message)
+
+    return StreamingResponse(
+        response.aiter_raw(),
+        status_code=response.status_code,
+        media_type="application/pdf",
+        headers=headers,
+        background=BackgroundTask(response.aclose)
+    )
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    if WS_UPSTREAM_MODE == "pooled":
+        await proxy_pooled(websocket)
+        return
+
     backend_ws_url = f"{BACKEND_URL}/ws"
 
     try:
@@ -105,27 +163,43 @@ async def forward_to_backend(client_ws: WebSocket, backend_ws: websockets.WebSoc
         await backend_ws.close()
 
 async def forward_to_client(client_ws: WebSocket, backend_ws: websockets.WebSocketClientProtocol):
+    # Frames are passed through as received; decoding them here only cost CPU per token
     try:
-        while True:
-            response = await backend_ws.recv()
-            response_data = json.loads(response)
-            logger.debug(f"Received from backend: {response_data}")
-
-            if "manual_results" in response_data:
-                logger.debug(f"Sending manual results to client: {response_data['manual_results']}")
-                await client_ws.send_json({"manual_results": response_data["manual_results"]})
-            elif "faq_results" in response_data:
-                logger.debug(f"Sending FAQ results to client: {response_data['faq_results']}")
-                await client_ws.send_json({"faq_results": response_data["faq_results"]})
-            elif "ai_response_chunk" in response_data:
-                await client_ws.send_json({"ai_response_chunk": response_data["ai_response_chunk"]})
-            elif "ai_response_end" in response_data:
-                await client_ws.send_json({"ai_response_end": True})
-            else:
-                await client_ws.send_text(response)
+        async for response in backend_ws:
+            await client_ws.send_text(response)
     except WebSocketDisconnect:
         await client_ws.close()
 
+async def proxy_pooled(client_ws: WebSocket):
+    try:
+        upstream, link = await upstream_pool.attach()
+    except Exception as e:
+        logger.error(f"Error connecting to backend: {str(e)}")
+        await client_ws.close(code=1011)
+        return
+
+    async def receive_from_client():
+        while True:
+            await upstream_pool.send(upstream, link, await client_ws.receive_text())
+
+    async def send_to_client():
+        while (frame := await link.queue.get()) is not None:
+            await client_ws.send_text(frame)
+        # The upstream connection was lost, or this client fell too far behind
+        await client_ws.close(code=1011)
+
+    tasks = [asyncio.create_task(receive_from_client()), asyncio.create_task(send_to_client())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                logger.error(f"Error: {str(task.exception())}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await upstream_pool.detach(upstream, link)
+        logger.info(f"WebSocket {link.connection_id} disconnected")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
@@ -9,6 +9,8 @@ document.addEventListener("DOMContentLoaded", function() {
     var finalAiResponse = document.getElementById("final-ai-response");
 
     var socket = new WebSocket("ws://" + window.location.host + "/ws");
+    var requestCounter = 0;
+    var currentRequestId = null;
 
     socket.onopen = function() {
         console.log("WebSocket connection established");
@@ -18,32 +20,42 @@ document.addEventListener("DOMContentLoaded", function() {
         try {
             var data = JSON.parse(event.data);
             console.log("Received data:", data);
+            if (data.request_id && data.request_id !== currentRequestId) {
+                // Late messages from a question the user has already moved on from
+                return;
+            }
             if (data.error) {
                 searchResults.innerHTML += "<p>Error: " + data.error + "</p>";
             } else if (data.manual_results) {
                 console.log("Displaying manual results:", data.manual_results);
                 displayResults(data.manual_results, "Manual Search Results", 4);
+            } else if (data.faq_fast_path) {
+                // Answered straight from a matching FAQ: there is no TOC routing step to show
+                firstAiResponse.innerHTML += "<p><em>FAQ fast path (distance: " + data.faq_fast_path.distance.toFixed(4) + ")</em></p>";
+                finalAiResponse.querySelector("h2").innerHTML = "Final AI Response (FAQ):";
             } else if (data.faq_results) {
                 console.log("Displaying FAQ results:", data.faq_results);
                 displayResults(data.faq_results, "FAQ Search Results", 3);
             } else if (data.first_ai_response_chunk) {
+                // Text nodes are appended as is, without re-parsing what is already shown
                 var responseP = firstAiResponse.querySelector("p") || firstAiResponse.appendChild(document.createElement("p"));
-                responseP.innerHTML += data.first_ai_response_chunk;
+                responseP.appendChild(document.createTextNode(data.first_ai_response_chunk));
             } else if (data.first_ai_response_end) {
                 var responseP = firstAiResponse.querySelector("p");
                 if (responseP) {
-                    responseP.innerHTML += "<br><em>(First response complete)</em>";
+                    responseP.insertAdjacentHTML("beforeend", "<br><em>(First response complete)</em>");
                 }
             } else if (data.pdf_info) {
                 displayPdfInfo(data.pdf_info);
             } else if (data.ai_response_chunk) {
                 var responseP = finalAiResponse.querySelector("p") || finalAiResponse.appendChild(document.createElement("p"));
-                responseP.innerHTML += data.ai_response_chunk;
+                responseP.appendChild(document.createTextNode(data.ai_response_chunk));
             } else if (data.ai_response_end) {
                 var responseP = finalAiResponse.querySelector("p");
                 if (responseP) {
-                    responseP.innerHTML += "<br><em>(Final response complete)</em>";
+                    responseP.insertAdjacentHTML("beforeend", "<br><em>(Final response complete)</em>");
                 }
+                currentRequestId = null;
             }
         } catch (error) {
             console.error("Error parsing WebSocket message:", error);
@@ -58,8 +70,14 @@ document.addEventListener("DOMContentLoaded", function() {
         var query = searchInput.value;
         var category = categorySelect.value;
         if (query && category) {
-            console.log("Sending search request:", { question: query, category: parseInt(category) });
-            socket.send(JSON.stringify({ question: query, category: parseInt(category) }));
+            if (currentRequestId) {
+                // The previous answer is no longer wanted; stop it on the server
+                socket.send(JSON.stringify({ cancel: true, request_id: currentRequestId }));
+            }
+            currentRequestId = "q" + Date.now() + "-" + (++requestCounter);
+            var request = { request_id: currentRequestId, question: query, category: parseInt(category) };
+            console.log("Sending search request:", request);
+            socket.send(JSON.stringify(request));
             searchResults.innerHTML = "<p>Searching...</p>";
             firstAiResponse.innerHTML = "<h2>First AI Response:</h2>";
             finalAiResponse.innerHTML = "<h2>Final AI Response:</h2>";
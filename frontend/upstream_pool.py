@@ -0,0 +1,131 @@
+# frontend/upstream_pool.py
+import asyncio
+import itertools
+import json
+import logging
+import re
+import uuid
+import websockets
+
+logger = logging.getLogger(__name__)
+
+# The backend serializes request_id first, so frames can be routed by their prefix alone
+REQUEST_ID_HEAD = '{"request_id":"'
+# Frames after which the backend sends nothing more for a request
+REQUEST_END_MARKS = ('"request_end":true', '"cancelled":true')
+# Client request ids are limited to characters that need no escaping in JSON, so the routed prefix is the id itself
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+class ClientLink:
+    """A browser socket attached to an upstream: its outgoing frame queue and its unfinished request ids."""
+
+    def __init__(self, connection_id, queue_size):
+        self.connection_id = connection_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.request_ids = set()
+
+class Upstream:
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.clients = {}
+        self.reader = None
+
+class UpstreamPool:
+    """A few backend websockets shared by all browser sockets.
+
+    Request ids are prefixed with the browser socket's connection id on the way in; frames coming back
+    are routed on that prefix, which is cut off again before the frame is forwarded unchanged.
+    A browser socket that falls queue_size frames behind is closed instead of buffering without bound.
+    """
+
+    def __init__(self, url, size, queue_size):
+        self.url = url
+        self.size = size
+        self.queue_size = queue_size
+        self._upstreams = []
+        self._lock = asyncio.Lock()
+        self._connection_ids = itertools.count(1)
+
+    async def attach(self):
+        link = ClientLink(f"c{next(self._connection_ids)}", self.queue_size)
+        async with self._lock:
+            if len(self._upstreams) < self.size:
+                upstream = Upstream(await websockets.connect(self.url))
+                upstream.reader = asyncio.create_task(self._read(upstream))
+                self._upstreams.append(upstream)
+                logger.info(f"Opened upstream connection {len(self._upstreams)}/{self.size}")
+            else:
+                upstream = min(self._upstreams, key=lambda upstream: len(upstream.clients))
+            upstream.clients[link.connection_id] = link
+        return upstream, link
+
+    async def send(self, upstream, link, text):
+        data = json.loads(text)
+        client_request_id = str(data.get("request_id") or uuid.uuid4().hex)
+        if not REQUEST_ID_PATTERN.fullmatch(client_request_id):
+            self._deliver(upstream, link, json.dumps({"error": "Invalid request_id"}))
+            return
+        request_id = f"{link.connection_id}:{client_request_id}"
+        data["request_id"] = request_id
+        if not data.get("cancel"):
+            link.request_ids.add(request_id)
+        await upstream.websocket.send(json.dumps(data, ensure_ascii=False))
+
+    async def detach(self, upstream, link):
+        upstream.clients.pop(link.connection_id, None)
+        # Answers nobody will read any more are stopped on the backend
+        for request_id in link.request_ids:
+            try:
+                await upstream.websocket.send(json.dumps({"cancel": True, "request_id": request_id}))
+            except websockets.ConnectionClosed:
+                break
+        link.request_ids.clear()
+
+    async def _read(self, upstream):
+        try:
+            async for frame in upstream.websocket:
+                self._route(upstream, frame)
+        except websockets.ConnectionClosed as e:
+            logger.warning(f"Upstream connection closed: {e}")
+        finally:
+            async with self._lock:
+                if upstream in self._upstreams:
+                    self._upstreams.remove(upstream)
+            for link in list(upstream.clients.values()):
+                self._close_link(upstream, link)
+
+    def _route(self, upstream, frame):
+        if not frame.startswith(REQUEST_ID_HEAD):
+            logger.debug(f"Dropped upstream frame without a request id: {frame[:80]}")
+            return
+        connection_id, _, rest = frame[len(REQUEST_ID_HEAD):].partition(":")
+        link = upstream.clients.get(connection_id)
+        if link is None:
+            return
+        if any(mark in rest for mark in REQUEST_END_MARKS):
+            request_id = rest.partition('"')[0]
+            link.request_ids.discard(f"{connection_id}:{request_id}")
+        self._deliver(upstream, link, REQUEST_ID_HEAD + rest)
+
+    def _deliver(self, upstream, link, frame):
+        try:
+            link.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # The browser is not reading: stop routing to it and let the proxy close it, which cancels its requests
+            logger.warning(f"Closing WebSocket {link.connection_id}: {link.queue.qsize()} frames not yet sent")
+            self._close_link(upstream, link)
+
+    def _close_link(self, upstream, link):
+        # Queued frames are still delivered before the close sentinel, unless the queue is full and they must make room
+        upstream.clients.pop(link.connection_id, None)
+        if link.queue.full():
+            while not link.queue.empty():
+                link.queue.get_nowait()
+        link.queue.put_nowait(None)
+
+    async def close(self):
+        async with self._lock:
+            upstreams, self._upstreams = self._upstreams, []
+        for upstream in upstreams:
+            await upstream.websocket.close()
+            upstream.reader.cancel()